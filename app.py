@@ -1,38 +1,141 @@
 import json
 import os
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
+from flask import Flask, Response, g, render_template, request, jsonify, session, send_from_directory, stream_with_context
 from flask_pymongo import PyMongo
-from bson import ObjectId
-from datetime import datetime
-from bs4 import BeautifulSoup
 import requests
-from trafilatura import extract
 import asyncio
-from playwright.async_api import async_playwright
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.naive_bayes import MultinomialNB
-from sklearn.pipeline import Pipeline
-import nltk
-from nltk.corpus import stopwords
+import contextvars
+from browser_pool import browser_pool
+import fetcher
+from robots_cache import robots_cache
+from content_cache import content_cache
+from document import ParsedDocument
+import db_indexes
+import importer
+import exporter
+from fetch_jobs import fetch_jobs
+from scheduler import scheduler
+from refresher import bookmark_refresher
+import services
+import versions
+import compression
+import classifier
+import fingerprint
+from metrics import metrics, MongoCommandListener, start_trace, format_trace
+import threading
+import click
 import time
-import robotexclusionrulesparser
-from werkzeug.security import generate_password_hash, check_password_hash
-from bson.objectid import ObjectId
+from bson.errors import InvalidId
 import re
 
-app = Flask(__name__, static_folder='static')
+_view_loop = None
+_view_loop_lock = threading.Lock()
+
+def view_loop():
+    global _view_loop
+    with _view_loop_lock:
+        if _view_loop is None:
+            _view_loop = asyncio.new_event_loop()
+            threading.Thread(target=_view_loop.run_forever, name='async-views', daemon=True).start()
+    return _view_loop
+
+class BookmarkApp(Flask):
+    # Async views run on one persistent event loop instead of a throwaway loop
+    # per request, so loop-bound resources can be shared between requests.
+    # The calling context, request context included, carries over to the task.
+    def ensure_sync(self, func):
+        if not asyncio.iscoroutinefunction(func):
+            return func
+
+        def run(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), view_loop()).result()
+        return run
+
+async def run_blocking(func, *args):
+    # CPU-heavy parsing stays off the shared loop; the copied context keeps its stage timings in the trace
+    return await asyncio.get_running_loop().run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+app = BookmarkApp(__name__, static_folder='static')
 app.config["MONGO_URI"] = "mongodb://localhost:27017/bookmarkmanager"
 app.secret_key = os.environ.get('SECRET_KEY')
-mongo = PyMongo(app)
+mongo = PyMongo(app, event_listeners=[MongoCommandListener(metrics)])
 
 BOOKMARKS_FILE = 'bookmarks.json'
-
-# Download necessary NLTK data
-nltk.download('stopwords')
-nltk.download('punkt')
-
-# Initialize the robots.txt parser
-rp = robotexclusionrulesparser.RobotExclusionRulesParser()
+LIST_LINK_LIMIT = int(os.environ.get('LIST_LINK_LIMIT', 20))
+MAX_LIST_LINK_LIMIT = 500
+# Each long-poll holds a server thread while it waits, so both how long and how many at once are capped
+MAX_LONG_POLL = float(os.environ.get('MAX_LONG_POLL', 10))
+LONG_POLL_SLOTS = int(os.environ.get('LONG_POLL_SLOTS', 4))
+_long_polls = threading.BoundedSemaphore(max(1, LONG_POLL_SLOTS))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # Opt-in stage breakdown for this request, returned as X-Debug-Timing
+    g.trace = start_trace() if request.headers.get('X-Debug-Timing') else None
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    if started is not None:
+        metrics.observe('http_request_seconds', time.perf_counter() - started,
+                        endpoint=request.endpoint or 'unknown', method=request.method)
+        metrics.inc('http_requests_total', endpoint=request.endpoint or 'unknown', status=response.status_code)
+    if g.get('trace') is not None:
+        response.headers['X-Debug-Timing'] = format_trace(g.trace)
+    return response
+
+@app.after_request
+def compress(response):
+    return compression.compress_response(response, request.accept_encodings)
+
+def service_error(e):
+    return jsonify({'success': False, 'error': e.message}), e.status
+
+def revalidated(etag):
+    # 304 when the client already holds this version of the view, in any encoding
+    for tag in compression.etag_variants(etag):
+        if request.if_none_match.contains(tag):
+            return with_etag(Response(status=304), tag)
+    return None
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # Per-user data: browsers revalidate every time and shared caches don't keep it
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+def init_db():
+    try:
+        db_indexes.ensure_indexes(mongo.db)
+    except Exception as e:
+        print(f"Error creating indexes: {str(e)}")
+
+@app.cli.command('ensure-indexes')
+def ensure_indexes_command():
+    db_indexes.ensure_indexes(mongo.db)
+    print("Indexes are up to date")
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    failures = db_indexes.check_query_plans(mongo.db)
+    for name, stages in failures.items():
+        print(f"{name} falls back to a collection scan: {' <- '.join(stages)}")
+    if failures:
+        raise SystemExit(1)
+    print("All hot queries use an index")
+
+@app.cli.command('train-classifier')
+def train_classifier_command():
+    classifier.train()
+    classifier.reset()
+
+@app.cli.command('reclassify')
+@click.option('--chunk-size', default=500, show_default=True, help='Bookmarks classified per batch.')
+def reclassify_command(chunk_size):
+    total = classifier.reclassify_bookmarks(mongo.db, chunk_size)
+    print(f"Reclassified {total} bookmarks")
 
 @app.route('/')
 def index():
@@ -41,30 +144,24 @@ def index():
 @app.route('/signup', methods=['POST'])
 def signup():
     data = request.json
-    username = data.get('username')
-    password = data.get('password')
-    
-    if mongo.db.users.find_one({"username": username}):
-        return jsonify({"error": "Username already exists"}), 400
-    
-    hashed_password = generate_password_hash(password)
-    mongo.db.users.insert_one({"username": username, "password": hashed_password})
-    
-    session['username'] = username
-    return jsonify({"success": True, "username": username})
+    try:
+        result = services.signup(mongo.db, data.get('username'), data.get('password'))
+    except services.ServiceError as e:
+        return service_error(e)
+
+    session['username'] = result['username']
+    return jsonify(result)
 
 @app.route('/login', methods=['POST'])
 def login():
     data = request.json
-    username = data.get('username')
-    password = data.get('password')
-    
-    user = mongo.db.users.find_one({"username": username})
-    if user and check_password_hash(user['password'], password):
-        session['username'] = username
-        return jsonify({"success": True, "username": username})
-    else:
-        return jsonify({"success": False, "error": "Invalid username or password"}), 401
+    try:
+        result = services.login(mongo.db, data.get('username'), data.get('password'))
+    except services.ServiceError as e:
+        return service_error(e)
+
+    session['username'] = result['username']
+    return jsonify(result)
 
 @app.route('/logout', methods=['POST'])
 def logout():
@@ -77,10 +174,68 @@ async def fetch_content_route():
         return jsonify({"error": "Not logged in"}), 401
     
     url = request.json['url']
-    content = await fetch_content(url)
+    try:
+        link_limit = max(1, min(int(request.json.get('link_limit', LIST_LINK_LIMIT)), MAX_LIST_LINK_LIMIT))
+        timeout = float(request.json['timeout']) if request.json.get('timeout') else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "link_limit and timeout must be numbers"}), 400
+    options = {'refresh': bool(request.json.get('refresh')), 'link_limit': link_limit, 'user': session['username']}
+
+    # Job mode: queue the fetch and let the client poll /fetch/jobs/<job_id>
+    if request.json.get('async'):
+        job = fetch_jobs.submit(fetch_content, session['username'], url, options, timeout)
+        if job is None:
+            response = jsonify({"error": "Too many pending fetches, please retry later"})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        return jsonify(job.to_json()), 202
+
+    content = await services.fetch(fetch_content, session['username'], url, options['refresh'], link_limit)
     return jsonify(content)
 
-async def fetch_content(url):
+@app.route('/fetch/jobs/<job_id>', methods=['GET'])
+def fetch_job_status(job_id):
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    job = fetch_jobs.get(job_id, session['username'])
+    if job is None:
+        return jsonify({"error": "Fetch job not found"}), 404
+    # Long-poll: ?wait=<seconds> blocks until the job finishes or the wait runs out
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_LONG_POLL)
+    except ValueError:
+        return jsonify({"error": "wait must be a number"}), 400
+    if wait > 0:
+        if _long_polls.acquire(blocking=False):
+            try:
+                job.done.wait(wait)
+            finally:
+                _long_polls.release()
+        else:
+            # Every long-poll slot is taken: a short wait keeps re-polling clients from spinning
+            job.done.wait(min(wait, 1))
+    return jsonify(job.to_json())
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    gauges = {f'content_cache_{key}': int(value) for key, value in content_cache.stats().items()}
+    gauges['fetch_jobs_queued'] = fetch_jobs.depth()
+    gauges.update({f'scheduler_{key}': value for key, value in scheduler.stats().items()})
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    return jsonify(content_cache.stats())
+
+async def fetch_content(url, refresh=False, link_limit=LIST_LINK_LIMIT, user=None):
+    with metrics.span('fetch_content'):
+        return await _fetch_content(url, refresh, link_limit, user)
+
+async def _fetch_content(url, refresh, link_limit, user):
     print(f"Received request to fetch URL: {url}")
     try:
         if not url or '//' not in url:
@@ -91,127 +246,305 @@ async def fetch_content(url):
         if len(parsed_url) < 2 or '/' not in parsed_url[1]:
             return {'error': 'Invalid URL format', 'type': 'error'}
 
-        domain = parsed_url[1].split('/', 1)[0]
-        robots_url = f"{parsed_url[0]}//{domain}/robots.txt"
-        print(f"Checking robots.txt at: {robots_url}")
-        rp.fetch(robots_url)
-        if not rp.is_allowed(url, '*'):
+        loop = asyncio.get_running_loop()
+        with metrics.span('robots'):
+            robots = await loop.run_in_executor(None, robots_cache.get, url)
+        if not robots.is_allowed(url):
             print(f"Access to {url} is not allowed by robots.txt")
+            metrics.inc('fetch_total', tier='none', cache='none', outcome='robots_disallowed')
             return {'error': 'Access to this URL is not allowed by robots.txt', 'type': 'error'}
-
-        print("Fetching content with JavaScript support...")
-        html_content = await fetch_url_with_js(url)
-        print("Analyzing content...")
-        page_type = analyze_page_type(html_content, url)
-        
-        if page_type == 'article':
-            print("Parsing article content...")
-            parsed_content = parse_content(html_content, url)
-            return {
-                'type': 'article',
-                'title': parsed_content['title'],
-                'summary': parsed_content['main_content'][:1000] + "...",
-                'full_text': parsed_content['main_content'],
-                'url': url
-            }
-        else:
-            print("Extracting links from list page...")
-            soup = BeautifulSoup(html_content, 'lxml')
-            links = extract_links_from_list(soup, url)
-            return {
-                'type': 'list',
-                'title': soup.title.string if soup.title else 'Link List',
-                'links': links,
-                'url': url
-            }
+        crawl_delay = robots.crawl_delay()
+
+        # Keyed by the canonical URL so tracking-parameter and AMP variants share one fetch
+        canonical_url = fingerprint.canonicalize_url(url)
+        cache_key = canonical_url if link_limit == LIST_LINK_LIMIT else f"{canonical_url} links={link_limit}"
+        cached = None if refresh else await content_cache.get_async(cache_key)
+        response = None
+        if cached is not None:
+            if cached.is_fresh():
+                content_cache.record('hits')
+                metrics.inc('fetch_total', tier=cached.result.get('tier'), cache='hit', outcome='ok')
+                return dict(cached.result, cache='hit')
+            conditional_headers = cached.conditional_headers()
+            if conditional_headers:
+                print("Revalidating cached content...")
+                try:
+                    async with scheduler.slot(url, user, crawl_delay):
+                        with metrics.span('revalidate'):
+                            response = await loop.run_in_executor(None, fetcher.fetch_url_plain, url,
+                                                                  conditional_headers)
+                except Exception as e:
+                    print(f"Revalidation failed: {str(e)}")
+                if response is not None and response.status_code == 304:
+                    content_cache.touch(cache_key, cached, response.headers)
+                    content_cache.record('revalidated')
+                    metrics.inc('fetch_total', tier=cached.result.get('tier'), cache='revalidated', outcome='ok')
+                    return dict(cached.result, cache='revalidated')
+        content_cache.record('misses')
+
+        doc = None
+        if response is not None and cached.result.get('tier') == 'http' and fetcher.is_html_response(response):
+            with metrics.span('parse_html'):
+                doc, tier, headers = await run_blocking(ParsedDocument, response.content), 'http', response.headers
+            if not fetcher.is_usable_html(doc):
+                doc = None
+        if doc is None:
+            doc, tier, headers = await fetch_html(url, user, crawl_delay)
+        result = await run_blocking(build_content, doc, url, tier, link_limit)
+        content_cache.put(cache_key, result, headers)
+        metrics.inc('fetch_total', tier=tier, cache='miss', outcome='ok')
+        return dict(result, cache='miss')
     except Exception as e:
         print(f"Error fetching content: {str(e)}")
+        metrics.inc('fetch_total', tier='none', cache='none', outcome='error')
+        metrics.inc('fetch_errors_total', type=type(e).__name__)
         import traceback
         traceback.print_exc()
         return {'error': str(e), 'type': 'error'}
 
+async def refresh_page(url, etag=None, last_modified=None, user=None):
+    # Conditional re-fetch for the background refresher. Returns (None, headers)
+    # when the page answers 304 and (result, headers) when it has to be rebuilt.
+    loop = asyncio.get_running_loop()
+    robots = await loop.run_in_executor(None, robots_cache.get, url)
+    if not robots.is_allowed(url):
+        raise PermissionError('Access to this URL is not allowed by robots.txt')
+    crawl_delay = robots.crawl_delay()
+
+    conditional_headers = {}
+    if etag:
+        conditional_headers['If-None-Match'] = etag
+    if last_modified:
+        conditional_headers['If-Modified-Since'] = last_modified
+    doc = None
+    if not fetcher.needs_js(url) or conditional_headers:
+        async with scheduler.slot(url, user, crawl_delay):
+            with metrics.span('revalidate'):
+                response = await loop.run_in_executor(None, fetcher.fetch_url_plain, url, conditional_headers)
+        if response.status_code == 304:
+            return None, response.headers
+        if response.status_code >= 400:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        if fetcher.is_html_response(response):
+            with metrics.span('parse_html'):
+                doc = await run_blocking(ParsedDocument, response.content)
+            if fetcher.is_usable_html(doc):
+                tier, headers = 'http', response.headers
+            else:
+                fetcher.remember_js_domain(url)
+                doc = None
+    if doc is None:
+        doc, tier, headers = await fetch_html(url, user, crawl_delay)
+    result = await run_blocking(build_content, doc, url, tier)
+    content_cache.put(fingerprint.canonicalize_url(url), result, headers)
+    return result, headers
+
+def build_content(doc, url, tier, link_limit=LIST_LINK_LIMIT):
+    print("Analyzing content...")
+    with metrics.span('analyze_page_type'):
+        page_type = analyze_page_type(doc, url)
+
+    if page_type == 'article':
+        print("Parsing article content...")
+        parsed_content = parse_content(doc, url)
+        return {
+            'type': 'article',
+            'title': parsed_content['title'],
+            'summary': parsed_content['main_content'][:1000] + "...",
+            'full_text': parsed_content['main_content'],
+            'metadata': parsed_content['metadata'],
+            'content_type': parsed_content['content_type'],
+            'simhash': parsed_content['simhash'],
+            'url': url,
+            'tier': tier
+        }
+    else:
+        print("Extracting links from list page...")
+        with metrics.span('extract_links_from_list'):
+            links = extract_links_from_list(doc, url, link_limit)
+        return {
+            'type': 'list',
+            'title': doc.title() or 'Link List',
+            'links': links,
+            'simhash': fingerprint.simhash(' '.join(f"{link['title']} {link['url']}" for link in links)),
+            'url': url,
+            'tier': tier
+        }
+
 @app.route('/save_bookmark', methods=['POST'])
 def save_bookmark():
     if 'username' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
-    data = request.json
     try:
-        bookmark_data = {
-            'username': session['username'],
-            'url': data.get('url', ''),
-            'title': data.get('title', ''),
-            'type': data.get('type', 'unknown')
-        }
-        if data['type'] == 'article':
-            bookmark_data['summary'] = data.get('summary', '')
-        elif data['type'] == 'list':
-            bookmark_data['links'] = data.get('links', [])
-        
-        mongo.db.bookmarks.insert_one(bookmark_data)
-        return jsonify({'success': True})
+        return jsonify(services.save_bookmark(mongo.db, session['username'], request.json))
     except Exception as e:
         print(f"Error saving bookmark: {str(e)}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/import', methods=['POST'])
+def import_bookmarks():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    # Accept either a multipart upload or the export as the raw request body
+    upload = request.files.get('file')
+    stream = upload.stream if upload else request.stream
+    file_format = importer.detect_format(upload.filename if upload else None, request.args.get('format'))
+    try:
+        job_id, total = importer.import_stream(mongo.db, session['username'], stream, file_format)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if total:
+        importer.enrichment_pool.submit(mongo.db, job_id, fetch_content)
+    return jsonify({'success': True, 'job_id': str(job_id), 'total': total}), 202
+
+@app.route('/import/<job_id>', methods=['GET'])
+def import_status(job_id):
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    try:
+        job = importer.job_status(mongo.db, job_id, session['username'])
+    except InvalidId:
+        job = None
+    if job is None:
+        return jsonify({"error": "Import job not found"}), 404
+    return jsonify(job)
+
+@app.route('/export', methods=['GET'])
+def export_bookmarks():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in exporter.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(exporter.FORMATS)}"}), 400
+    mimetype, extension = exporter.FORMATS[export_format]
+    # Streamed from a batched cursor, so memory use doesn't grow with the collection
+    rows = exporter.iter_export(mongo.db, session['username'], export_format)
+    response = Response(stream_with_context(rows), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="bookmarks.{extension}"'
+    return response
+
 @app.route('/bookmarks', methods=['GET'])
 def get_bookmarks():
     if 'username' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
-    bookmarks = list(mongo.db.bookmarks.find({'username': session['username']}).sort('_id', -1))
-    for bookmark in bookmarks:
-        bookmark['_id'] = str(bookmark['_id'])  # Convert ObjectId to string
-    return jsonify(bookmarks)
+    args = request.args
+    # Answered from the user's change version alone when nothing changed
+    etag = versions.etag(mongo.db, session['username'], 'bookmarks', sorted(args.items(multi=True)))
+    not_modified = revalidated(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        return with_etag(jsonify(services.list_bookmarks(mongo.db, session['username'], args.get('fields'),
+                                                         args.get('limit'), args.get('after'), args.get('before'))),
+                         etag)
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/search', methods=['GET'])
+def search_bookmarks():
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    try:
+        return jsonify(services.search_bookmarks(mongo.db, session['username'], request.args.get('q'),
+                                                 request.args.get('limit'), request.args.get('page')))
+    except services.ServiceError as e:
+        return service_error(e)
 
 @app.route('/bookmark/<bookmark_id>', methods=['GET'])
 def get_bookmark(bookmark_id):
     if 'username' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
-    bookmark = mongo.db.bookmarks.find_one({'_id': ObjectId(bookmark_id), 'username': session['username']})
-    if bookmark:
-        bookmark['_id'] = str(bookmark['_id'])  # Convert ObjectId to string
-        return jsonify(bookmark)
-    else:
-        return jsonify({"error": "Bookmark not found"}), 404
+    etag = versions.etag(mongo.db, session['username'], 'bookmark', bookmark_id)
+    not_modified = revalidated(etag)
+    if not_modified is not None:
+        return not_modified
+    try:
+        return with_etag(jsonify(services.get_bookmark(mongo.db, session['username'], bookmark_id)), etag)
+    except services.ServiceError as e:
+        return service_error(e)
+
+@app.route('/bookmark/<bookmark_id>/content', methods=['GET'])
+async def get_bookmark_content(bookmark_id):
+    if 'username' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    try:
+        return jsonify(await services.get_bookmark_content(mongo.db, session['username'], bookmark_id, fetch_content))
+    except services.ServiceError as e:
+        return service_error(e)
 
 async def fetch_url_with_js(url):
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        page = await browser.new_page()
-        await page.goto(url)
-        # Wait for any JavaScript to finish executing
-        await page.wait_for_load_state('networkidle')
-        content = await page.content()
-        await browser.close()
-        return content
-
-def parse_content(html_content, url):
-    soup = BeautifulSoup(html_content, 'lxml')
-    
-    title = soup.title.string if soup.title else ''
+    return await browser_pool.render(url)
+
+async def fetch_html(url, user=None, crawl_delay=None):
+    # Try a plain HTTP GET first and only render headlessly when the page needs it.
+    # Network requests wait for a slot from the per-host politeness scheduler.
+    if not fetcher.needs_js(url):
+        print("Fetching content over plain HTTP...")
+        try:
+            async with scheduler.slot(url, user, crawl_delay):
+                with metrics.span('fetch_http'):
+                    response = await asyncio.get_running_loop().run_in_executor(None, fetcher.fetch_url_plain, url)
+            if fetcher.is_html_response(response):
+                with metrics.span('parse_html'):
+                    doc = await run_blocking(ParsedDocument, response.content)
+                if fetcher.is_usable_html(doc):
+                    return doc, 'http', response.headers
+                # Only a page that loaded but came out empty marks its domain as needing JavaScript
+                print("Plain HTML is not usable, escalating to JavaScript rendering")
+                fetcher.remember_js_domain(url)
+            else:
+                print(f"Plain HTTP fetch got status {response.status_code} without an HTML page, "
+                      f"escalating to JavaScript rendering")
+        except Exception as e:
+            print(f"Plain HTTP fetch failed, escalating to JavaScript rendering: {str(e)}")
+
+    print("Fetching content with JavaScript support...")
+    async with scheduler.slot(url, user, crawl_delay):
+        with metrics.span('render'):
+            html_content, headers = await fetch_url_with_js(url)
+    with metrics.span('parse_html'):
+        doc = await run_blocking(ParsedDocument, html_content)
+    return doc, 'browser', headers
+
+def parse_content(doc, url):
+    title = doc.title()
     
     # Use a more sophisticated content extraction method
-    main_content = extract_main_content(html_content)
+    with metrics.span('extract_main_content'):
+        main_content = extract_main_content(doc)
     
     metadata = {
-        'author': soup.find('meta', {'name': 'author'})['content'] if soup.find('meta', {'name': 'author'}) else '',
-        'description': soup.find('meta', {'name': 'description'})['content'] if soup.find('meta', {'name': 'description'}) else '',
-        'keywords': soup.find('meta', {'name': 'keywords'})['content'] if soup.find('meta', {'name': 'keywords'}) else '',
+        'author': doc.meta(name='author'),
+        'description': doc.meta(name='description'),
+        'keywords': doc.meta(name='keywords'),
     }
     
     # Try to extract Open Graph metadata
-    og_title = soup.find('meta', {'property': 'og:title'})
-    og_description = soup.find('meta', {'property': 'og:description'})
+    og_title = doc.meta(property='og:title')
+    og_description = doc.meta(property='og:description')
     if og_title:
-        metadata['og_title'] = og_title['content']
+        metadata['og_title'] = og_title
     if og_description:
-        metadata['og_description'] = og_description['content']
+        metadata['og_description'] = og_description
     
-    content_type = classify_content_ml(title, main_content)
+    with metrics.span('classify'):
+        content_type = classifier.classify(title, main_content)
     
-    links = extract_links(soup, url)
+    with metrics.span('extract_links'):
+        links = extract_links(doc, url)
+
+    # Fingerprint of the extracted text, for near-duplicate lookups
+    with metrics.span('fingerprint'):
+        simhash = fingerprint.html_simhash(main_content)
     
     return {
         'title': title,
@@ -219,7 +552,8 @@ def parse_content(html_content, url):
         'metadata': metadata,
         'url': url,
         'content_type': content_type,
-        'links': links
+        'links': links,
+        'simhash': simhash
     }
 
 def load_bookmarks():
@@ -232,41 +566,27 @@ def save_bookmarks(bookmarks):
     with open(BOOKMARKS_FILE, 'w') as f:
         json.dump(bookmarks, f)
 
-def extract_links(soup, base_url):
+def extract_links(doc, base_url):
     links = []
-    for a in soup.find_all('a', href=True):
-        href = a['href']
+    for href, text, _, _ in doc.iter_links():
         full_url = requests.compat.urljoin(base_url, href)
-        links.append({'text': a.text.strip(), 'url': full_url})
+        links.append({'text': text, 'url': full_url})
     return links
 
-def classify_content_ml(title, main_content):
-    combined_text = f"{title} {main_content}"
-    return classifier.predict([combined_text])[0]
-
-def extract_main_content(html_content):
+def extract_main_content(doc):
     # Use readability-lxml for better content extraction
     from readability import Document
-    doc = Document(html_content)
-    return doc.summary()
-
-# Train a simple ML model for content classification
-def train_classifier():
-    # This is a placeholder. In a real scenario, you'd use a larger, labeled dataset.
-    X = ["This is a news article about current events",
-         "Check out our new product for sale",
-         "Welcome to my personal blog",
-         "Here's the documentation for our API"]
-    y = ["news", "product", "blog", "documentation"]
-
-    classifier = Pipeline([
-        ('tfidf', TfidfVectorizer(stop_words=stopwords.words('english'))),
-        ('clf', MultinomialNB()),
-    ])
-    classifier.fit(X, y)
-    return classifier
-
-classifier = train_classifier()
+    return Document(doc.readability_input()).summary()
+
+def warm_up():
+    # Load the heavy pieces in the background so the first fetch doesn't pay for them
+    def load():
+        try:
+            classifier.get_model()
+            import readability
+        except Exception as e:
+            print(f"Error during warm-up: {str(e)}")
+    threading.Thread(target=load, name='warm-up', daemon=True).start()
 
 @app.route('/check_login')
 def check_login():
@@ -289,65 +609,71 @@ def delete_bookmark(bookmark_id):
         return jsonify({"error": "Not logged in"}), 401
     
     try:
-        result = mongo.db.bookmarks.delete_one({
-            '_id': ObjectId(bookmark_id),
-            'username': session['username']
-        })
-        
-        if result.deleted_count == 1:
-            return jsonify({'success': True})
-        else:
-            return jsonify({'success': False, 'error': 'Bookmark not found or not authorized'}), 404
+        return jsonify(services.delete_bookmark(mongo.db, session['username'], bookmark_id))
+    except services.ServiceError as e:
+        return service_error(e)
     except Exception as e:
         print(f"Error deleting bookmark: {str(e)}")
         return jsonify({'success': False, 'error': 'Server error'}), 500
 
-def analyze_page_type(html_content, url):
-    soup = BeautifulSoup(html_content, 'lxml')
-    
+def analyze_page_type(doc, url):
     # Check URL structure
     if re.search(r'/\d{4}/\d{2}/\d{2}/', url) or re.search(r'/article/', url):
         return 'article'
     
     # Analyze content structure
-    article_tags = soup.find_all(['article', 'div', 'section'], class_=re.compile(r'article|post|content'))
-    if len(article_tags) == 1 and len(article_tags[0].get_text()) > 1000:
+    article_tags = doc.find_by_class(['article', 'div', 'section'], r'article|post|content')
+    if len(article_tags) == 1 and len(doc.text(article_tags[0])) > 1000:
         return 'article'
     
     # Check for list-like structures
-    list_items = soup.find_all(['ul', 'ol', 'div'], class_=re.compile(r'list|grid'))
-    if list_items and len(list_items[0].find_all('a')) > 5:
+    list_items = doc.find_by_class(['ul', 'ol', 'div'], r'list|grid')
+    if list_items and doc.link_count(list_items[0]) > 5:
+        doc.link_container = list_items[0]
         return 'list'
     
     # Analyze text-to-link ratio
-    text_length = len(soup.get_text())
-    link_count = len(soup.find_all('a'))
+    text_length = len(doc.text())
+    link_count = doc.link_count()
     if link_count > 0 and text_length / link_count < 100:
         return 'list'
     
     # Default to article if uncertain
     return 'article'
 
-def extract_links_from_list(soup, base_url):
+def extract_links_from_list(doc, base_url, limit=LIST_LINK_LIMIT):
     links = []
-    for a in soup.find_all('a', href=True):
-        href = a['href']
-        full_url = requests.compat.urljoin(base_url, href)
-        title = a.get_text().strip() or a.get('title', '')
-        
-        # Extract image if available
-        img = a.find('img')
-        img_src = img['src'] if img and 'src' in img.attrs else None
-        if img_src:
-            img_src = requests.compat.urljoin(base_url, img_src)
-        
-        if title and full_url not in [link['url'] for link in links]:
+    seen = set()
+    # Links inside the list container found by analyze_page_type rank first
+    sources = [None] if doc.link_container is None else [doc.link_container, None]
+    for node in sources:
+        for href, text, title_attr, img_src in doc.iter_links(node):
+            if href.startswith(('#', 'javascript:')):
+                continue
+            title = text or title_attr
+            if not title:
+                continue
+            full_url = requests.compat.urljoin(base_url, href)
+            if full_url in seen:
+                continue
+            seen.add(full_url)
+
+            # Extract image if available
+            if img_src:
+                img_src = requests.compat.urljoin(base_url, img_src)
+
             links.append({
                 'title': title,
                 'url': full_url,
                 'image': img_src
             })
-    return links[:20]  # Limit to top 20 links
+            if len(links) >= limit:
+                return links
+    return links
 
 if __name__ == '__main__':
+    # Development server; run.py serves the app in production
+    init_db()
+    warm_up()
+    bookmark_refresher.start(mongo.db, refresh_page)
     app.run(use_reloader=True, port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,15 @@
+import os
+from a2wsgi import WSGIMiddleware
+from app import app, init_db, warm_up, mongo, refresh_page
+from refresher import bookmark_refresher
+
+# Threads serving requests in each worker process
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 10))
+
+# Entry point for ASGI servers, e.g. `uvicorn asgi:application --workers 4`.
+# Each worker process runs this once.
+init_db()
+warm_up()
+# Every worker starts one; a lease in MongoDB lets only one of them sweep at a time
+bookmark_refresher.start(mongo.db, refresh_page)
+application = WSGIMiddleware(app, workers=WEB_THREADS)
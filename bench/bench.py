@@ -0,0 +1,229 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+CORPUS_DIR = os.path.join(BENCH_DIR, 'corpus')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+sys.path.insert(0, ROOT_DIR)
+# The corpus server is local: measure the pipeline, not the politeness spacing
+os.environ.setdefault('FETCH_HOST_INTERVAL', '0')
+os.environ.setdefault('FETCH_HOST_CONCURRENCY', '64')
+os.environ.setdefault('FETCH_MAX_CONCURRENCY', '64')
+
+# URL path -> corpus file. The paths avoid the /article/ and date patterns so
+# analyze_page_type does its full content analysis.
+PAGES = {
+    'small_article': ('/posts/small-article.html', 'small_article.html'),
+    'huge_article': ('/posts/huge-article.html', 'huge_article.html'),
+    'link_index': ('/stories/index.html', 'link_index.html'),
+}
+
+
+class CorpusHandler(SimpleHTTPRequestHandler):
+    routes = {path: filename for path, filename in PAGES.values()}
+
+    def translate_path(self, path):
+        filename = self.routes.get(path.split('?', 1)[0])
+        # Anything else, robots.txt included, is a 404
+        return os.path.join(CORPUS_DIR, filename) if filename else os.path.join(CORPUS_DIR, 'missing')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(CorpusHandler, directory=CORPUS_DIR))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bench-corpus', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def summarize(samples):
+    # samples in seconds -> milliseconds
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(percentile(50), 3),
+        'p95_ms': round(percentile(95), 3),
+        'p99_ms': round(percentile(99), 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def scenario_result(end_to_end, stages, wall_seconds, errors=0):
+    return {
+        'requests': len(end_to_end),
+        'errors': errors,
+        'wall_seconds': round(wall_seconds, 4),
+        'throughput_rps': round(len(end_to_end) / wall_seconds, 2) if wall_seconds else None,
+        'end_to_end': summarize(end_to_end),
+        'stages': {stage: summarize(values) for stage, values in sorted(stages.items())},
+    }
+
+
+async def fetch_scenario(app_module, urls, iterations, concurrency, refresh=True):
+    from metrics import start_trace
+
+    semaphore = asyncio.Semaphore(concurrency)
+    end_to_end = []
+    stages = {}
+    errors = 0
+
+    async def one(url):
+        nonlocal errors
+        async with semaphore:
+            # Each task has its own context, so traces of concurrent fetches stay apart
+            trace = start_trace()
+            started = time.perf_counter()
+            result = await app_module.fetch_content(url, refresh=refresh)
+            end_to_end.append(time.perf_counter() - started)
+            if result.get('type') == 'error' or result.get('tier') != 'http':
+                errors += 1
+            for stage, seconds in trace:
+                if stage != 'fetch_content':
+                    stages.setdefault(stage, []).append(seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(url) for _ in range(iterations) for url in urls))
+    return scenario_result(end_to_end, stages, time.perf_counter() - started, errors)
+
+
+def save_scenario(app_module, client, urls, iterations):
+    end_to_end = []
+    stages = {}
+    errors = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        for url in urls:
+            request_started = time.perf_counter()
+            response = client.post('/save_bookmark', json={'url': f"{url}?utm_source=bench{i}", 'title': 'Bench',
+                                                           'type': 'article'},
+                                   headers={'X-Debug-Timing': '1'})
+            end_to_end.append(time.perf_counter() - request_started)
+            if response.status_code != 200 or not response.json.get('success'):
+                errors += 1
+            for part in filter(None, response.headers.get('X-Debug-Timing', '').split(', ')):
+                stage, _, duration = part.partition(';dur=')
+                stages.setdefault(stage, []).append(float(duration) / 1000)
+    return scenario_result(end_to_end, stages, time.perf_counter() - started, errors)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_results(results):
+    print(f"{'scenario':<36} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, scenario in results['scenarios'].items():
+        e2e = scenario['end_to_end'] or {}
+        print(f"{name:<36} {scenario['throughput_rps'] or 0:>9.2f} {e2e.get('p50_ms', 0):>9.2f} "
+              f"{e2e.get('p95_ms', 0):>9.2f} {e2e.get('p99_ms', 0):>9.2f}")
+        for stage, summary in scenario['stages'].items():
+            print(f"  {stage:<34} {'':>9} {summary['p50_ms']:>9.2f} {summary['p95_ms']:>9.2f} {summary['p99_ms']:>9.2f}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_revision')}, {baseline.get('timestamp')}):")
+    for name, scenario in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before or not before.get('end_to_end') or not scenario.get('end_to_end'):
+            continue
+        deltas = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before['end_to_end'][key], scenario['end_to_end'][key]
+            deltas.append(f"{key[:-3]} {(new - old) / old * 100:+.1f}%" if old else f"{key[:-3]} n/a")
+        old_rps, new_rps = before.get('throughput_rps'), scenario.get('throughput_rps')
+        if old_rps and new_rps:
+            deltas.append(f"throughput {(new_rps - old_rps) / old_rps * 100:+.1f}%")
+        print(f"  {name:<36} {'  '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fetch and save pipeline against a local corpus.')
+    parser.add_argument('--iterations', type=int, default=20, help='Fetches per page in each scenario.')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma separated concurrency levels to run.')
+    parser.add_argument('--output', help='Where to write the JSON results (default bench/results/<timestamp>.json).')
+    parser.add_argument('--compare', help='A previous results file to compare against.')
+    parser.add_argument('--verbose', action='store_true', help="Show the app's own logging while running.")
+    args = parser.parse_args()
+    # The fetch pipeline prints progress for every request; keep it out of the report
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    import mongomock
+    import app as app_module
+
+    # In-memory stand-in for MongoDB, so runs are repeatable and don't need a server
+    app_module.mongo.db = mongomock.MongoClient().db
+    app_module.app.secret_key = 'bench'
+    server, base_url = start_server()
+    urls = {name: base_url + path for name, (path, _) in PAGES.items()}
+
+    # Warm-up: robots.txt, classifier, readability, connection pools
+    for url in urls.values():
+        with quiet:
+            result = asyncio.run(app_module.fetch_content(url, refresh=True))
+        print(f"Warm-up {url}: {result.get('type')} via {result.get('tier')}")
+
+    results = {
+        'timestamp': datetime.utcnow().isoformat(),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser_mode': os.environ.get('PARSER_MODE', 'soup'),
+        'iterations': args.iterations,
+        'scenarios': {},
+    }
+    scenarios = results['scenarios']
+    with quiet:
+        for name, url in urls.items():
+            scenarios[f"fetch.{name}"] = asyncio.run(fetch_scenario(app_module, [url], args.iterations, 1))
+            scenarios[f"fetch.{name}.cached"] = asyncio.run(
+                fetch_scenario(app_module, [url], args.iterations, 1, refresh=False))
+        for concurrency in [int(level) for level in args.concurrency.split(',') if level]:
+            scenarios[f"fetch.mixed.c{concurrency}"] = asyncio.run(
+                fetch_scenario(app_module, list(urls.values()), args.iterations, concurrency))
+
+        client = app_module.app.test_client()
+        client.post('/signup', json={'username': 'bench', 'password': 'bench'})
+        scenarios['save_bookmark'] = save_scenario(app_module, client, list(urls.values()), args.iterations)
+    server.shutdown()
+
+    print_results(results)
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
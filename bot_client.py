@@ -0,0 +1,235 @@
+import asyncio
+import os
+from collections import OrderedDict
+from functools import partial
+import aiohttp
+
+BACKEND_TIMEOUT = float(os.environ.get('BACKEND_TIMEOUT', 30))
+BACKEND_FETCH_TIMEOUT = float(os.environ.get('BACKEND_FETCH_TIMEOUT', 120))
+BACKEND_MAX_CONNECTIONS = int(os.environ.get('BACKEND_MAX_CONNECTIONS', 20))
+BACKEND_LONG_POLL = 10
+# Bookmark list responses kept for revalidation with If-None-Match
+BACKEND_ETAG_CACHE_SIZE = int(os.environ.get('BACKEND_ETAG_CACHE_SIZE', 256))
+
+
+class BackendError(Exception):
+    def __init__(self, status, message):
+        super().__init__(f"{status} {message}")
+        self.status = status
+
+
+class BackendResponse:
+    def __init__(self, status, data, session_id=None, headers=None):
+        self.status = status
+        self.data = data
+        self.session_id = session_id
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            message = self.data.get('error') if isinstance(self.data, dict) else None
+            raise BackendError(self.status, message or 'Request failed')
+
+
+class BackendClient:
+    # One keep-alive session shared by every bot handler. Cookies are never
+    # stored on the session itself: each call carries its own user's session id.
+    def __init__(self, base_url, max_connections=BACKEND_MAX_CONNECTIONS, timeout=BACKEND_TIMEOUT):
+        self.base_url = (base_url or '').rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = None
+        self._etags = OrderedDict()
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method, path, session_id=None, json=None, params=None, timeout=None, headers=None):
+        client = await self.start()
+        headers = dict(headers or {})
+        if session_id:
+            headers['Cookie'] = f"session={session_id}"
+        kwargs = {'timeout': aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        async with client.request(method, f"{self.base_url}{path}", json=json, params=params,
+                                  headers=headers, **kwargs) as response:
+            if response.content_type == 'application/json':
+                data = await response.json()
+            else:
+                data = await response.text()
+            cookie = response.cookies.get('session')
+            return BackendResponse(response.status, data, cookie.value if cookie else None, response.headers.copy())
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request('DELETE', path, **kwargs)
+
+    async def get_revalidated(self, path, session_id=None, params=None):
+        # Sends the ETag of the last response to this call; on 304 that response is reused
+        key = (session_id, path, tuple(sorted((params or {}).items())))
+        cached = self._etags.get(key)
+        headers = {'If-None-Match': cached[0]} if cached else None
+        response = await self.get(path, params=params, session_id=session_id, headers=headers)
+        if response.status == 304 and cached:
+            self._etags.move_to_end(key)
+            return BackendResponse(200, cached[1], headers=response.headers)
+        if response.status == 200 and response.headers.get('ETag'):
+            self._etags[key] = (response.headers['ETag'], response.data)
+            self._etags.move_to_end(key)
+            while len(self._etags) > BACKEND_ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+        return response
+
+    async def signup(self, username, password):
+        return await self.post("/signup", json={"username": username, "password": password})
+
+    async def login(self, username, password):
+        return await self.post("/login", json={"username": username, "password": password})
+
+    async def logout(self, session_id=None):
+        return await self.post("/logout", session_id=session_id)
+
+    async def save_bookmark(self, data, session_id=None):
+        return await self.post("/save_bookmark", json=data, session_id=session_id)
+
+    async def list_bookmarks(self, session_id=None, **params):
+        return await self.get_revalidated("/bookmarks", session_id=session_id, params=params)
+
+    async def search(self, terms, session_id=None, **params):
+        return await self.get("/search", params=dict(params, q=terms), session_id=session_id)
+
+    async def bookmark_content(self, bookmark_id, session_id=None):
+        return await self.get(f"/bookmark/{bookmark_id}/content", session_id=session_id)
+
+    async def fetch(self, url, session_id=None, **options):
+        # Runs /fetch as a background job and long-polls until it finishes
+        payload = dict(options, url=url, timeout=BACKEND_FETCH_TIMEOUT)
+        payload['async'] = True
+        response = await self.post("/fetch", json=payload, session_id=session_id)
+        response.raise_for_status()
+        job = response.data
+        while job['status'] in ('queued', 'running'):
+            response = await self.get(f"/fetch/jobs/{job['job_id']}", params={'wait': BACKEND_LONG_POLL},
+                                      session_id=session_id, timeout=BACKEND_LONG_POLL + self.timeout)
+            if response.status == 404:
+                # Jobs live in the memory of the worker that took them; another worker
+                # doesn't know this one, so fetch synchronously instead
+                del payload['async']
+                response = await self.post("/fetch", json=payload, session_id=session_id,
+                                           timeout=BACKEND_FETCH_TIMEOUT + self.timeout)
+                response.raise_for_status()
+                return BackendResponse(200, response.data)
+            response.raise_for_status()
+            job = response.data
+        return BackendResponse(200, job['result'])
+
+
+class LocalClient:
+    # Same interface as BackendClient for a bot running inside the web app's
+    # process: calls go straight to the service layer with no HTTP round trip,
+    # and the username stands in for the session id.
+    def __init__(self, db, fetch_content):
+        # Imported here so a bot talking to a remote web app doesn't load the app's modules
+        import services
+        import versions
+        self.services = services
+        self.versions = versions
+        self.db = db
+        self.fetch_content = fetch_content
+        # Bookmark lists by user and parameters, reused while the user's change version stands
+        self._lists = OrderedDict()
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def _error(self, e):
+        return BackendResponse(e.status, {'success': False, 'error': e.message})
+
+    async def _call(self, func, *args, session_id=None):
+        # MongoDB calls are blocking, so they run off the bot's event loop
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, partial(func, self.db, *args))
+        except self.services.ServiceError as e:
+            return self._error(e)
+        return BackendResponse(200, data, session_id)
+
+    def _not_logged_in(self):
+        return BackendResponse(401, {'error': 'Not logged in'})
+
+    async def signup(self, username, password):
+        return await self._call(self.services.signup, username, password, session_id=username)
+
+    async def login(self, username, password):
+        return await self._call(self.services.login, username, password, session_id=username)
+
+    async def logout(self, session_id=None):
+        return BackendResponse(200, {'success': True})
+
+    async def save_bookmark(self, data, session_id=None):
+        if not session_id:
+            return self._not_logged_in()
+        return await self._call(self.services.save_bookmark, session_id, data)
+
+    async def list_bookmarks(self, session_id=None, **params):
+        if not session_id:
+            return self._not_logged_in()
+        key = (session_id, tuple(sorted(params.items())))
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, self.versions.current, self.db, session_id)
+        cached = self._lists.get(key)
+        if cached and cached[0] == version:
+            self._lists.move_to_end(key)
+            return BackendResponse(200, cached[1], session_id)
+        response = await self._call(self.services.list_bookmarks, session_id, params.get('fields'),
+                                    params.get('limit'), params.get('after'), params.get('before'))
+        if response.status == 200:
+            self._lists[key] = (version, response.data)
+            while len(self._lists) > BACKEND_ETAG_CACHE_SIZE:
+                self._lists.popitem(last=False)
+        return response
+
+    async def search(self, terms, session_id=None, **params):
+        if not session_id:
+            return self._not_logged_in()
+        return await self._call(self.services.search_bookmarks, session_id, terms, params.get('limit'),
+                                params.get('page'))
+
+    async def bookmark_content(self, bookmark_id, session_id=None):
+        if not session_id:
+            return self._not_logged_in()
+        try:
+            content = await self.services.get_bookmark_content(self.db, session_id, bookmark_id, self.fetch_content)
+        except self.services.ServiceError as e:
+            return self._error(e)
+        return BackendResponse(200, content)
+
+    async def fetch(self, url, session_id=None, **options):
+        if not session_id:
+            return self._not_logged_in()
+        try:
+            content = await asyncio.wait_for(
+                self.services.fetch(self.fetch_content, session_id, url, options.get('refresh', False),
+                                    options.get('link_limit')),
+                BACKEND_FETCH_TIMEOUT)
+        except asyncio.TimeoutError:
+            return BackendResponse(504, {'error': f'Fetch did not finish within {BACKEND_FETCH_TIMEOUT:g} seconds'})
+        return BackendResponse(200, content)
@@ -0,0 +1,264 @@
+import asyncio
+import atexit
+import os
+import threading
+import time
+from fetcher import MIN_TEXT_LENGTH, get_domain
+from metrics import metrics
+
+BROWSER_POOL_BROWSERS = int(os.environ.get('BROWSER_POOL_BROWSERS', 1))
+BROWSER_POOL_MAX_PAGES = int(os.environ.get('BROWSER_POOL_MAX_PAGES', 4))
+BROWSER_POOL_RECYCLE_AFTER = int(os.environ.get('BROWSER_POOL_RECYCLE_AFTER', 50))
+# We only need the DOM text and links, so these resource types are never downloaded
+RENDER_BLOCK_RESOURCES = {t.strip() for t in os.environ.get(
+    'RENDER_BLOCK_RESOURCES', 'image,media,font,stylesheet').split(',') if t.strip()}
+RENDER_BLOCK_DOMAINS = tuple(d.strip().lower() for d in os.environ.get(
+    'RENDER_BLOCK_DOMAINS',
+    'doubleclick.net,googlesyndication.com,googleadservices.com,google-analytics.com,googletagmanager.com,'
+    'adservice.google.com,amazon-adsystem.com,adnxs.com,criteo.com,criteo.net,taboola.com,outbrain.com,'
+    'scorecardresearch.com,quantserve.com,chartbeat.com,hotjar.com,facebook.net,connect.facebook.net,'
+    'moatads.com,pubmatic.com,rubiconproject.com,openx.net,casalemedia.com,segment.io,newrelic.com,'
+    'nr-data.net,optimizely.com').split(',') if d.strip())
+# Hard limit on one render; past it the DOM captured so far is used
+RENDER_DEADLINE = float(os.environ.get('RENDER_DEADLINE', 15))
+# The page is ready once the DOM has stopped changing for this long
+RENDER_QUIET_MS = int(os.environ.get('RENDER_QUIET_MS', 500))
+
+# Resolves with 'stable' once no DOM mutation has happened for quietMs (three
+# times as long while the page has little text yet), or 'deadline'
+WAIT_FOR_STABLE_DOM = '''([quietMs, timeoutMs, minText]) => new Promise(resolve => {
+    const start = performance.now();
+    let last = start;
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(document, {childList: true, subtree: true, characterData: true});
+    const check = () => {
+        const now = performance.now();
+        const text = document.body ? document.body.textContent.length : 0;
+        const quiet = text > 0 && now - last >= (text >= minText ? quietMs : quietMs * 3);
+        if (quiet || now - start >= timeoutMs) {
+            observer.disconnect();
+            resolve(quiet ? 'stable' : 'deadline');
+        } else {
+            setTimeout(check, 100);
+        }
+    };
+    check();
+})'''
+
+
+def is_blocked_domain(url):
+    host = get_domain(url).split(':')[0]
+    return any(host == domain or host.endswith('.' + domain) for domain in RENDER_BLOCK_DOMAINS)
+
+
+class PageSlot:
+    def __init__(self, browser_index):
+        self.browser_index = browser_index
+        self.context = None
+        self.page = None
+        self.navigations = 0
+        self.stats = None
+
+    def reset_stats(self):
+        self.stats = {'blocked': 0, 'blocked_by_type': {}, 'requests': 0, 'bytes': 0}
+
+
+class BrowserPool:
+    # Playwright objects are bound to the event loop that created them, while
+    # Flask runs every async view on a throwaway loop. The pool therefore owns
+    # a dedicated loop thread and callers submit work to it.
+    def __init__(self, browsers=BROWSER_POOL_BROWSERS, max_pages=BROWSER_POOL_MAX_PAGES,
+                 recycle_after=BROWSER_POOL_RECYCLE_AFTER):
+        self.browser_count = max(1, browsers)
+        self.max_pages = max(1, max_pages)
+        self.recycle_after = recycle_after
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._playwright = None
+        self._browsers = []
+        self._browser_locks = []
+        self._start_guard = None
+        self._slots = None
+        self._closed = False
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._closed:
+                raise RuntimeError('Browser pool has been shut down')
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='browser-pool', daemon=True)
+                self._thread.start()
+        return self._loop
+
+    async def _start(self):
+        if self._playwright is not None:
+            return
+        # Created on the pool's loop; concurrent first renders wait here for one start
+        if self._start_guard is None:
+            self._start_guard = asyncio.Lock()
+        async with self._start_guard:
+            if self._playwright is not None:
+                return
+            print(f"Starting browser pool: {self.browser_count} browser(s), {self.max_pages} page(s)")
+            # Imported here so processes that never render don't pay for playwright
+            from playwright.async_api import async_playwright
+            self._browsers = [None] * self.browser_count
+            self._browser_locks = [asyncio.Lock() for _ in range(self.browser_count)]
+            self._slots = asyncio.Queue()
+            for i in range(self.max_pages):
+                self._slots.put_nowait(PageSlot(i % self.browser_count))
+            self._playwright = await async_playwright().start()
+
+    async def _get_browser(self, index):
+        browser = self._browsers[index]
+        if browser is not None and browser.is_connected():
+            return browser
+        # Slots sharing this browser wait for one launch instead of each launching their own
+        async with self._browser_locks[index]:
+            browser = self._browsers[index]
+            if browser is None or not browser.is_connected():
+                if browser is not None:
+                    print(f"Browser {index} disconnected, relaunching")
+                browser = await self._playwright.chromium.launch()
+                self._browsers[index] = browser
+            return browser
+
+    async def _open_slot(self, slot):
+        browser = await self._get_browser(slot.browser_index)
+        slot.context = await browser.new_context()
+        slot.reset_stats()
+        if RENDER_BLOCK_RESOURCES or RENDER_BLOCK_DOMAINS:
+            await slot.context.route('**/*', lambda route: self._route(slot, route))
+        slot.page = await slot.context.new_page()
+        slot.page.on('response', lambda response: self._count_response(slot, response))
+        slot.navigations = 0
+
+    async def _route(self, slot, route):
+        request = route.request
+        if request.resource_type in RENDER_BLOCK_RESOURCES or is_blocked_domain(request.url):
+            reason = request.resource_type if request.resource_type in RENDER_BLOCK_RESOURCES else 'blocklist'
+            slot.stats['blocked'] += 1
+            slot.stats['blocked_by_type'][reason] = slot.stats['blocked_by_type'].get(reason, 0) + 1
+            await route.abort()
+        else:
+            await route.continue_()
+
+    def _count_response(self, slot, response):
+        slot.stats['requests'] += 1
+        try:
+            slot.stats['bytes'] += int(response.headers.get('content-length', 0))
+        except ValueError:
+            pass
+
+    async def _wait_until_ready(self, page, deadline):
+        # DOM-stability check instead of networkidle, which ad-heavy pages may never reach
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return 'deadline'
+        try:
+            return await asyncio.wait_for(
+                page.evaluate(WAIT_FOR_STABLE_DOM, [RENDER_QUIET_MS, remaining * 1000, MIN_TEXT_LENGTH]),
+                remaining + 0.25)
+        except asyncio.TimeoutError:
+            return 'deadline'
+        except Exception as e:
+            # e.g. a client-side redirect destroyed the execution context
+            print(f"Readiness check failed: {str(e)}")
+            return 'error'
+
+    def _report(self, url, slot, ready, elapsed):
+        stats = slot.stats
+        metrics.inc('render_pages_total', ready=ready)
+        metrics.observe('render_seconds', elapsed, ready=ready)
+        metrics.inc('render_bytes_total', stats['bytes'])
+        for reason, count in stats['blocked_by_type'].items():
+            metrics.inc('render_blocked_requests_total', count, reason=reason)
+        blocked = ', '.join(f"{count} {reason}" for reason, count in sorted(stats['blocked_by_type'].items()))
+        print(f"Rendered {url} in {elapsed * 1000:.0f} ms ({ready}): loaded {stats['requests']} requests, "
+              f"{stats['bytes'] / 1024:.0f} KB; blocked {stats['blocked']} requests ({blocked or 'none'})")
+
+    async def _close_slot(self, slot):
+        if slot.context is not None:
+            try:
+                await slot.context.close()
+            except Exception:
+                pass
+        slot.context = None
+        slot.page = None
+        slot.navigations = 0
+
+    async def _render(self, url):
+        await self._start()
+        # Requests queue here for a free page instead of launching their own browser
+        slot = await self._slots.get()
+        try:
+            if slot.page is None or slot.page.is_closed():
+                await self._close_slot(slot)
+                await self._open_slot(slot)
+            slot.navigations += 1
+            slot.reset_stats()
+            started = time.monotonic()
+            deadline = started + RENDER_DEADLINE
+            response = None
+            try:
+                response = await slot.page.goto(url, wait_until='domcontentloaded', timeout=RENDER_DEADLINE * 1000)
+                ready = await self._wait_until_ready(slot.page, deadline)
+            except Exception as e:
+                if 'Timeout' not in type(e).__name__:
+                    raise
+                # Fall back to whatever DOM has arrived by the deadline
+                ready = 'deadline'
+            html = await slot.page.content()
+            self._report(url, slot, ready, time.monotonic() - started)
+            headers = response.headers if response is not None else {}
+            return html, headers
+        except Exception:
+            # The page or its browser may have crashed; start over with a fresh context
+            await self._close_slot(slot)
+            raise
+        finally:
+            if slot.navigations >= self.recycle_after:
+                await self._close_slot(slot)
+            self._slots.put_nowait(slot)
+
+    async def render(self, url):
+        future = asyncio.run_coroutine_threadsafe(self._render(url), self._ensure_loop())
+        return await asyncio.wrap_future(future)
+
+    async def _shutdown(self):
+        if self._slots is not None:
+            while not self._slots.empty():
+                await self._close_slot(self._slots.get_nowait())
+        for browser in self._browsers:
+            if browser is not None:
+                try:
+                    await browser.close()
+                except Exception:
+                    pass
+        self._browsers = []
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    def shutdown(self, timeout=10):
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            loop = self._loop
+        if loop is None:
+            return
+        print("Shutting down browser pool...")
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception as e:
+            print(f"Error shutting down browser pool: {str(e)}")
+        loop.call_soon_threadsafe(loop.stop)
+        self._thread.join(timeout)
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.shutdown)
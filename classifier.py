@@ -0,0 +1,142 @@
+import os
+import threading
+from pymongo import UpdateOne
+import content_store
+import versions
+
+CLASSIFIER_PATH = os.environ.get('CLASSIFIER_PATH', os.path.join('models', 'classifier.joblib'))
+# 'tfidf' keeps a vocabulary in memory; 'hashing' keeps memory flat however large the vocabulary grows
+CLASSIFIER_VECTORIZER = os.environ.get('CLASSIFIER_VECTORIZER', 'tfidf')
+HASHING_FEATURES = 2 ** 18
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def english_stopwords():
+    # Checked once per process; set NLTK_DATA to point at a vendored copy
+    import nltk
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+    from nltk.corpus import stopwords
+    return stopwords.words('english')
+
+
+def training_data():
+    # This is a placeholder. In a real scenario, you'd use a larger, labeled dataset.
+    X = ["This is a news article about current events",
+         "Check out our new product for sale",
+         "Welcome to my personal blog",
+         "Here's the documentation for our API"]
+    y = ["news", "product", "blog", "documentation"]
+    return X, y
+
+
+def build_pipeline(vectorizer=CLASSIFIER_VECTORIZER):
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+    from sklearn.naive_bayes import MultinomialNB
+    from sklearn.pipeline import Pipeline
+
+    if vectorizer == 'hashing':
+        steps = [
+            # MultinomialNB needs non-negative features
+            ('hashing', HashingVectorizer(stop_words=english_stopwords(), n_features=HASHING_FEATURES,
+                                          alternate_sign=False)),
+            ('tfidf', TfidfTransformer()),
+        ]
+    else:
+        steps = [('tfidf', TfidfVectorizer(stop_words=english_stopwords()))]
+    return Pipeline(steps + [('clf', MultinomialNB())])
+
+
+def train(vectorizer=CLASSIFIER_VECTORIZER, path=CLASSIFIER_PATH):
+    import joblib
+
+    X, y = training_data()
+    pipeline = build_pipeline(vectorizer)
+    pipeline.fit(X, y)
+    model = {'vectorizer': vectorizer, 'pipeline': pipeline}
+    if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        joblib.dump(model, path)
+        print(f"Saved content classifier to {path}")
+    return model
+
+
+def load(path=CLASSIFIER_PATH):
+    import joblib
+
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        # Memory-mapped so several worker processes share the model's arrays
+        model = joblib.load(path, mmap_mode='r')
+    except Exception as e:
+        print(f"Error loading content classifier from {path}: {str(e)}")
+        return None
+    if model.get('vectorizer') != CLASSIFIER_VECTORIZER:
+        return None
+    return model
+
+
+def get_model():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load() or train()
+    return _model
+
+
+def reset():
+    global _model
+    with _model_lock:
+        _model = None
+
+
+def classify(title, main_content):
+    return classify_batch([(title, main_content)])[0]
+
+
+def classify_batch(documents):
+    # documents: iterable of (title, main_content); vectorized and predicted in one call
+    texts = [f"{title} {main_content}" for title, main_content in documents]
+    if not texts:
+        return []
+    return [str(label) for label in get_model()['pipeline'].predict(texts)]
+
+
+def bookmark_text(bookmark, content=None):
+    if content is not None:
+        return bookmark.get('title', ''), content.get('full_text') or content.get('summary', '')
+    if bookmark.get('links'):
+        return bookmark.get('title', ''), ' '.join(link.get('title', '') for link in bookmark['links'])
+    return bookmark.get('title', ''), bookmark.get('summary', '')
+
+
+def reclassify_bookmarks(db, chunk_size=500):
+    # Reclassifies every stored bookmark, one vectorized predict call per chunk
+    cursor = db.bookmarks.find({}, {'username': 1, 'title': 1, 'summary': 1, 'links': 1, 'content_hash': 1}
+                               ).batch_size(chunk_size)
+    total = 0
+    chunk = []
+    for bookmark in cursor:
+        chunk.append(bookmark)
+        if len(chunk) >= chunk_size:
+            total += _reclassify_chunk(db, chunk)
+            chunk = []
+    if chunk:
+        total += _reclassify_chunk(db, chunk)
+    return total
+
+
+def _reclassify_chunk(db, chunk):
+    hashes = list({b['content_hash'] for b in chunk if b.get('content_hash')})
+    contents = content_store.load_contents(db, hashes) if hashes else {}
+    labels = classify_batch([bookmark_text(b, contents.get(b.get('content_hash'))) for b in chunk])
+    db.bookmarks.bulk_write([UpdateOne({'_id': b['_id']}, {'$set': {'content_type': label}})
+                             for b, label in zip(chunk, labels)], ordered=False)
+    versions.bump(db, *(b.get('username') for b in chunk))
+    return len(chunk)
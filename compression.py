@@ -0,0 +1,50 @@
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON bodies at least this large are compressed when the client accepts it
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_MIMETYPES = ('application/json',)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+ENCODINGS = ('br', 'gzip')
+
+
+def choose_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def etag_variants(etag):
+    # A compressed body is a different representation, so it carries its own strong ETag
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+def compress_response(response, accept_encodings):
+    if response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    data = response.get_data()
+    encoding = choose_encoding(accept_encodings) if len(data) >= COMPRESS_MIN_SIZE else None
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=BROTLI_QUALITY))
+    else:
+        response.set_data(gzip.compress(data, GZIP_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
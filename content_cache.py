@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CONTENT_CACHE_TTL = int(os.environ.get('CONTENT_CACHE_TTL', 3600))
+CONTENT_CACHE_MAX_TTL = int(os.environ.get('CONTENT_CACHE_MAX_TTL', 7 * 24 * 3600))
+CONTENT_CACHE_DIR = os.environ.get('CONTENT_CACHE_DIR')
+CONTENT_CACHE_DISK_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024))
+
+
+class CacheEntry:
+    def __init__(self, result, etag=None, last_modified=None, stored_at=None, expires_at=None):
+        self.result = result
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at or time.time()
+        self.expires_at = expires_at or self.stored_at + CONTENT_CACHE_TTL
+        self.size = len(json.dumps(result))
+
+    def is_fresh(self):
+        return self.expires_at > time.time()
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def to_json(self):
+        return {
+            'result': self.result,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'stored_at': self.stored_at,
+            'expires_at': self.expires_at,
+        }
+
+
+def _expiry_from_headers(headers, now):
+    cache_control = headers.get('cache-control', '')
+    match = re.search(r'max-age=(\d+)', cache_control)
+    if 'no-cache' in cache_control or 'no-store' in cache_control:
+        return now
+    if match:
+        return now + min(int(match.group(1)), CONTENT_CACHE_MAX_TTL)
+    return now + CONTENT_CACHE_TTL
+
+
+class ContentCache:
+    # An in-memory LRU of fetch results, optionally backed by a directory of
+    # JSON files. Disk writes and removals run in order on one writer thread,
+    # which also keeps the directory within disk_max_bytes, oldest files first.
+    def __init__(self, max_bytes=CONTENT_CACHE_MAX_BYTES, disk_dir=CONTENT_CACHE_DIR,
+                 disk_max_bytes=CONTENT_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Disk files by path, oldest first; only touched on the writer thread
+        self._disk_files = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_writer = None
+        self.counters = {'hits': 0, 'misses': 0, 'revalidated': 0, 'disk_hits': 0, 'evictions': 0,
+                         'disk_evictions': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='content-cache-disk')
+            self._disk_writer.submit(self._scan_disk)
+
+    def _disk_path(self, url):
+        return os.path.join(self.disk_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _store_memory(self, url, entry):
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old is not None:
+                self._bytes -= old.size
+            if entry.size > self.max_bytes:
+                return
+            self._entries[url] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.counters['evictions'] += 1
+
+    def _scan_disk(self):
+        # Picks up files left by earlier runs, so the budget covers them too
+        files = []
+        try:
+            with os.scandir(self.disk_dir) as it:
+                for item in it:
+                    if item.name.endswith('.json'):
+                        stat = item.stat()
+                        files.append((stat.st_mtime, item.path, stat.st_size))
+        except OSError as e:
+            print(f"Error scanning content cache directory: {str(e)}")
+        for _, path, size in sorted(files):
+            self._disk_files[path] = size
+            self._disk_bytes += size
+        self._trim_disk()
+
+    def _forget_disk(self, path):
+        self._disk_bytes -= self._disk_files.pop(path, 0)
+
+    def _trim_disk(self):
+        while self._disk_bytes > self.disk_max_bytes and self._disk_files:
+            path, size = self._disk_files.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.record('disk_evictions')
+
+    def _write_disk(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing content cache file: {str(e)}")
+            return
+        self._forget_disk(path)
+        self._disk_files[path] = os.path.getsize(path)
+        self._disk_bytes += self._disk_files[path]
+        self._trim_disk()
+
+    def _remove_disk(self, path):
+        self._forget_disk(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _store_disk(self, url, entry):
+        if self._disk_writer is None:
+            return
+        # Snapshot now: touch() changes the entry in place after this returns
+        self._disk_writer.submit(self._write_disk, self._disk_path(url), entry.to_json())
+
+    def _load_disk(self, url):
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._disk_path(url), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(data['result'], data.get('etag'), data.get('last_modified'),
+                          data.get('stored_at'), data.get('expires_at'))
+
+    def _get_memory(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def get(self, url):
+        entry = self._get_memory(url)
+        if entry is not None:
+            return entry
+        entry = self._load_disk(url)
+        if entry is not None:
+            self.record('disk_hits')
+            self._store_memory(url, entry)
+        return entry
+
+    async def get_async(self, url):
+        # For callers on an event loop: memory hits answer at once, disk reads go to the executor
+        entry = self._get_memory(url)
+        if entry is not None or not self.disk_dir:
+            return entry
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, url)
+
+    def put(self, url, result, headers):
+        now = time.time()
+        entry = CacheEntry(result, headers.get('etag'), headers.get('last-modified'),
+                           now, _expiry_from_headers(headers, now))
+        self._store_memory(url, entry)
+        self._store_disk(url, entry)
+        return entry
+
+    def touch(self, url, entry, headers):
+        # A 304 response confirms the cached result; only its lifetime changes
+        now = time.time()
+        entry.stored_at = now
+        entry.expires_at = _expiry_from_headers(headers, now)
+        entry.etag = headers.get('etag') or entry.etag
+        entry.last_modified = headers.get('last-modified') or entry.last_modified
+        self._store_memory(url, entry)
+        self._store_disk(url, entry)
+
+    def invalidate(self, url):
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if self._disk_writer is not None:
+            # Queued behind any pending write of the same file
+            self._disk_writer.submit(self._remove_disk, self._disk_path(url))
+
+    def record(self, outcome):
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries), bytes=self._bytes,
+                        max_bytes=self.max_bytes, disk=bool(self.disk_dir), disk_bytes=self._disk_bytes,
+                        disk_max_bytes=self.disk_max_bytes)
+
+
+content_cache = ContentCache()
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import zlib
+from datetime import datetime
+from bson import Binary
+
+# The URL lives on the bookmark, so the same page saved under two URLs is stored once
+CONTENT_FIELDS = ('type', 'title', 'summary', 'full_text', 'links', 'metadata', 'content_type')
+
+
+def encode_content(content):
+    data = {field: content[field] for field in CONTENT_FIELDS if field in content}
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest(), raw
+
+
+def store_content(db, content):
+    # Identical extracted pages hash to the same document, which is stored
+    # once and reference counted by the bookmarks pointing at it
+    content_hash, raw = encode_content(content)
+    compressed = zlib.compress(raw, 6)
+    db.contents.update_one(
+        {'_id': content_hash},
+        {
+            '$setOnInsert': {
+                'codec': 'zlib',
+                'data': Binary(compressed),
+                'size': len(raw),
+                'compressed_size': len(compressed),
+                'created_at': datetime.utcnow(),
+            },
+            '$inc': {'refs': 1},
+        },
+        upsert=True,
+    )
+    return content_hash
+
+
+def load_content(db, content_hash):
+    doc = db.contents.find_one({'_id': content_hash}, {'data': 1})
+    if doc is None:
+        return None
+    return json.loads(zlib.decompress(doc['data']).decode('utf-8'))
+
+
+def load_contents(db, content_hashes):
+    return {doc['_id']: json.loads(zlib.decompress(doc['data']).decode('utf-8'))
+            for doc in db.contents.find({'_id': {'$in': list(content_hashes)}}, {'data': 1})}
+
+
+def release_content(db, content_hash):
+    if not content_hash:
+        return
+    db.contents.update_one({'_id': content_hash}, {'$inc': {'refs': -1}})
+    db.contents.delete_one({'_id': content_hash, 'refs': {'$lte': 0}})
@@ -0,0 +1,71 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+# (collection, keys, options) for every index the app's queries rely on
+INDEXES = [
+    ('users', [('username', ASCENDING)], {'unique': True, 'name': 'username_unique'}),
+    ('bookmarks', [('username', ASCENDING), ('_id', DESCENDING)], {'name': 'username_id'}),
+    ('bookmarks', [('import_job_id', ASCENDING), ('enrichment', ASCENDING)], {'name': 'import_job', 'sparse': True}),
+    # Near-duplicate lookups: exact canonical URL and SimHash LSH buckets, per user
+    ('bookmarks', [('username', ASCENDING), ('canonical_url', ASCENDING)], {'name': 'username_canonical_url'}),
+    ('bookmarks', [('username', ASCENDING), ('simhash_bands', ASCENDING)], {'name': 'username_simhash_bands'}),
+    # Background refresh picks the longest overdue bookmarks first
+    ('bookmarks', [('next_refresh_at', ASCENDING)], {'name': 'next_refresh'}),
+    # The username prefix keeps each search inside one user's bookmarks
+    ('bookmarks', [('username', ASCENDING), ('title', TEXT), ('summary', TEXT), ('url', TEXT), ('links.title', TEXT)],
+     {'name': 'username_text', 'weights': {'title': 10, 'links.title': 3, 'url': 2, 'summary': 1},
+      'default_language': 'english'}),
+]
+
+
+def ensure_indexes(db):
+    for collection, keys, options in INDEXES:
+        db[collection].create_index(keys, **options)
+
+
+def hot_queries(db):
+    # Representative shapes of the queries issued on every request
+    sample_user = 'index-check'
+    return {
+        'users.by_username': db.users.find({'username': sample_user}).limit(1),
+        'bookmarks.list': db.bookmarks.find({'username': sample_user}).sort('_id', -1),
+        'bookmarks.page': db.bookmarks.find({'username': sample_user}).sort('_id', -1).limit(21),
+        'bookmarks.page_after': db.bookmarks.find(
+            {'username': sample_user, '_id': {'$lt': ObjectId('f' * 24)}}).sort('_id', -1).limit(21),
+        'bookmarks.page_before': db.bookmarks.find(
+            {'username': sample_user, '_id': {'$gt': ObjectId('0' * 24)}}).sort('_id', 1).limit(21),
+        'bookmarks.export': db.bookmarks.find({'username': sample_user}).sort('_id', 1).batch_size(500),
+        'bookmarks.search': db.bookmarks.find(
+            {'username': sample_user, '$text': {'$search': 'index check'}},
+            {'score': {'$meta': 'textScore'}}).sort([('score', {'$meta': 'textScore'})]).limit(21),
+        'bookmarks.duplicates': db.bookmarks.find(
+            {'username': sample_user, '$or': [{'canonical_url': 'https://example.com/'},
+                                              {'simhash_bands': {'$in': ['0:0000', '1:0000']}}]}).limit(50),
+        'bookmarks.refresh_due': db.bookmarks.find(
+            {'$or': [{'next_refresh_at': None}, {'next_refresh_at': {'$lte': datetime(2000, 1, 1)}}],
+             'enrichment': {'$ne': 'pending'}}).sort('next_refresh_at', 1).limit(400),
+    }
+
+
+def _plan_stages(plan):
+    if not isinstance(plan, dict):
+        return
+    if 'stage' in plan:
+        yield plan['stage']
+    for key in ('inputStage', 'queryPlan', 'outerStage', 'innerStage'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def check_query_plans(db):
+    # Returns {query name: winning plan stages} for every hot query that scans a whole collection
+    failures = {}
+    for name, cursor in hot_queries(db).items():
+        plan = cursor.explain()['queryPlanner']['winningPlan']
+        stages = list(_plan_stages(plan))
+        if 'COLLSCAN' in stages:
+            failures[name] = stages
+    return failures
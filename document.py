@@ -0,0 +1,123 @@
+import copy
+import os
+import re
+from bs4 import BeautifulSoup, Comment
+import lxml.html
+
+# 'soup' wraps the single parse in BeautifulSoup; 'lxml' skips the wrapper entirely
+PARSER_MODE = os.environ.get('PARSER_MODE', 'soup')
+
+INVISIBLE_TAGS = ('script', 'style', 'noscript', 'template')
+
+
+class ParsedDocument:
+    # One parse of a fetched page, shared by page-type analysis, metadata and
+    # link extraction, classification and main-content extraction.
+    def __init__(self, html_content, mode=PARSER_MODE):
+        self.html = html_content
+        self.mode = mode
+        # Link-dense list container spotted by analyze_page_type, if any
+        self.link_container = None
+        if mode == 'lxml':
+            self.tree = self._parse_lxml(html_content)
+            self.soup = None
+        else:
+            self.tree = None
+            self.soup = BeautifulSoup(html_content, 'lxml')
+
+    @staticmethod
+    def _parse_lxml(html_content):
+        if isinstance(html_content, str):
+            try:
+                return lxml.html.document_fromstring(html_content)
+            except ValueError:
+                # lxml refuses str input that carries an XML encoding declaration
+                html_content = html_content.encode('utf-8')
+        return lxml.html.document_fromstring(html_content)
+
+    @property
+    def root(self):
+        return self.tree if self.mode == 'lxml' else self.soup
+
+    def title(self):
+        if self.mode == 'lxml':
+            node = self.tree.find('.//title')
+            return node.text_content().strip() if node is not None else ''
+        # A plain str, not a NavigableString that would keep the whole soup alive
+        return str(self.soup.title.string) if self.soup.title and self.soup.title.string else ''
+
+    def meta(self, name=None, property=None):
+        if self.mode == 'lxml':
+            attr, value = ('name', name) if name else ('property', property)
+            for node in self.tree.iter('meta'):
+                if node.get(attr) == value:
+                    return node.get('content', '')
+            return ''
+        node = self.soup.find('meta', {'name': name} if name else {'property': property})
+        return node.get('content', '') if node else ''
+
+    def find_by_class(self, tags, pattern):
+        pattern = re.compile(pattern)
+        if self.mode == 'lxml':
+            return [node for node in self.tree.iter(*tags)
+                    if any(pattern.search(c) for c in node.get('class', '').split())]
+        return self.soup.find_all(tags, class_=pattern)
+
+    def text(self, node=None):
+        node = self.root if node is None else node
+        if self.mode == 'lxml':
+            return node.text_content()
+        return node.get_text()
+
+    def visible_text(self):
+        if self.mode == 'lxml':
+            body = self.tree.find('body')
+            if body is None:
+                return ''
+            hidden = ' or '.join(f'ancestor::{tag}' for tag in INVISIBLE_TAGS)
+            parts = body.xpath(f'.//text()[not({hidden})]')
+        else:
+            if self.soup.body is None:
+                return ''
+            parts = [t for t in self.soup.body.find_all(string=True)
+                     if t.parent.name not in INVISIBLE_TAGS and not isinstance(t, Comment)]
+        return ' '.join(' '.join(parts).split())
+
+    def element_by_id(self, element_id):
+        if self.mode == 'lxml':
+            return self.tree.get_element_by_id(element_id, None)
+        return self.soup.find(id=element_id)
+
+    def is_empty(self, node):
+        if self.mode == 'lxml':
+            return len(node) == 0 and not node.text_content().strip()
+        return not node.find(True) and not node.get_text().strip()
+
+    def link_count(self, node=None):
+        node = self.root if node is None else node
+        if self.mode == 'lxml':
+            return sum(1 for _ in node.iter('a'))
+        return len(node.find_all('a'))
+
+    def iter_links(self, node=None):
+        # Yields (href, text, title attribute, image src) for every <a href> under node
+        node = self.root if node is None else node
+        if self.mode == 'lxml':
+            for a in node.iter('a'):
+                href = a.get('href')
+                if href is None:
+                    continue
+                img = next(a.iter('img'), None)
+                yield href, a.text_content().strip(), a.get('title', ''), img.get('src') if img is not None else None
+        else:
+            # descendants is lazy, so callers that stop early skip the rest of the page
+            for a in node.descendants:
+                if a.name != 'a' or not a.has_attr('href'):
+                    continue
+                img = a.find('img')
+                yield a['href'], a.get_text().strip(), a.get('title', ''), img.get('src') if img else None
+
+    def readability_input(self):
+        # readability prunes hidden nodes from the tree it is given, so it gets a copy;
+        # copying an lxml tree is still cheaper than the reparse soup mode leaves to it
+        return copy.deepcopy(self.tree) if self.mode == 'lxml' else self.html
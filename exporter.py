@@ -0,0 +1,93 @@
+import csv
+import html
+import io
+import json
+import os
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+EXPORT_FIELDS = {'url': 1, 'title': 1, 'type': 1, 'summary': 1, 'links': 1, 'content_type': 1}
+CSV_COLUMNS = ['id', 'url', 'title', 'type', 'content_type', 'summary', 'added']
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'html': ('text/html; charset=utf-8', 'html'),
+}
+
+
+def iter_bookmarks(db, username):
+    # Oldest first, fetched from the server EXPORT_BATCH_SIZE documents at a time
+    cursor = db.bookmarks.find({'username': username}, EXPORT_FIELDS).sort('_id', 1).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        yield from cursor
+    finally:
+        cursor.close()
+
+
+def ndjson_record(bookmark):
+    record = {
+        'id': str(bookmark['_id']),
+        'url': bookmark.get('url', ''),
+        'title': bookmark.get('title', ''),
+        'type': bookmark.get('type', 'unknown'),
+        'added': bookmark['_id'].generation_time.isoformat(),
+    }
+    for field in ('content_type', 'summary', 'links'):
+        if bookmark.get(field):
+            record[field] = bookmark[field]
+    return json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_ndjson(bookmarks):
+    for bookmark in bookmarks:
+        yield ndjson_record(bookmark)
+
+
+def iter_csv(bookmarks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for bookmark in bookmarks:
+        writer.writerow([
+            str(bookmark['_id']),
+            bookmark.get('url', ''),
+            bookmark.get('title', ''),
+            bookmark.get('type', 'unknown'),
+            bookmark.get('content_type', ''),
+            bookmark.get('summary', ''),
+            bookmark['_id'].generation_time.isoformat(),
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def iter_netscape_html(bookmarks):
+    # The format browsers import and export, and that /import reads back
+    yield ('<!DOCTYPE NETSCAPE-Bookmark-file-1>\n'
+           '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+           '<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n')
+    for bookmark in bookmarks:
+        added = int(bookmark['_id'].generation_time.timestamp())
+        yield (f'    <DT><A HREF="{html.escape(bookmark.get("url", ""))}" ADD_DATE="{added}">'
+               f'{html.escape(bookmark.get("title", ""))}</A>\n')
+    yield '</DL><p>\n'
+
+
+def iter_export(db, username, export_format):
+    bookmarks = iter_bookmarks(db, username)
+    if export_format == 'csv':
+        rows = iter_csv(bookmarks)
+    elif export_format == 'html':
+        rows = iter_netscape_html(bookmarks)
+    else:
+        rows = iter_ndjson(bookmarks)
+    # Joined into chunks so the response isn't written one small row at a time
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= 100:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+import time
+import uuid
+
+FETCH_JOB_WORKERS = int(os.environ.get('FETCH_JOB_WORKERS', 4))
+FETCH_JOB_QUEUE_SIZE = int(os.environ.get('FETCH_JOB_QUEUE_SIZE', 100))
+FETCH_JOB_TIMEOUT = float(os.environ.get('FETCH_JOB_TIMEOUT', 60))
+FETCH_JOB_MAX_TIMEOUT = float(os.environ.get('FETCH_JOB_MAX_TIMEOUT', 300))
+FETCH_JOB_TTL = int(os.environ.get('FETCH_JOB_TTL', 600))
+
+
+class FetchJob:
+    def __init__(self, fetch_content, username, url, options, timeout):
+        self.id = uuid.uuid4().hex
+        self.fetch_content = fetch_content
+        self.username = username
+        self.url = url
+        self.options = options
+        self.timeout = timeout
+        self.status = 'queued'
+        self.result = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_json(self):
+        data = {
+            'job_id': self.id,
+            'url': self.url,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.result is not None:
+            data['result'] = self.result
+        return data
+
+
+class FetchJobQueue:
+    # Runs fetch_content for queued jobs on a background loop with a fixed
+    # number of workers. Submissions beyond the queue size are refused.
+    def __init__(self, workers=FETCH_JOB_WORKERS, max_queue=FETCH_JOB_QUEUE_SIZE):
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._jobs = {}
+        self._queued = 0
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queue = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='fetch-jobs', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._start_workers(), self._loop).result()
+        return self._loop
+
+    async def _start_workers(self):
+        self._queue = asyncio.Queue()
+        for _ in range(self.workers):
+            asyncio.get_running_loop().create_task(self._worker())
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            with self._lock:
+                self._queued -= 1
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                job.result = await asyncio.wait_for(job.fetch_content(job.url, **job.options), job.timeout)
+                job.status = 'failed' if job.result.get('type') == 'error' else 'done'
+            except asyncio.TimeoutError:
+                job.status = 'timeout'
+                job.result = {'error': f'Fetch did not finish within {job.timeout:g} seconds', 'type': 'error'}
+            except Exception as e:
+                job.status = 'failed'
+                job.result = {'error': str(e), 'type': 'error'}
+            job.finished_at = time.time()
+            job.done.set()
+
+    def _purge(self):
+        expired = time.time() - FETCH_JOB_TTL
+        for job_id in [job.id for job in self._jobs.values() if job.finished_at and job.finished_at < expired]:
+            del self._jobs[job_id]
+
+    def submit(self, fetch_content, username, url, options=None, timeout=None):
+        # Returns the new job, or None when the queue is full
+        timeout = min(timeout or FETCH_JOB_TIMEOUT, FETCH_JOB_MAX_TIMEOUT)
+        loop = self._ensure_started()
+        with self._lock:
+            self._purge()
+            if self._queued >= self.max_queue:
+                return None
+            job = FetchJob(fetch_content, username, url, options or {}, timeout)
+            self._jobs[job.id] = job
+            self._queued += 1
+        loop.call_soon_threadsafe(self._queue.put_nowait, job)
+        return job
+
+    def get(self, job_id, username):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.username != username:
+            return None
+        return job
+
+    def depth(self):
+        with self._lock:
+            return self._queued
+
+
+fetch_jobs = FetchJobQueue()
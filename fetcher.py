@@ -0,0 +1,73 @@
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+
+USER_AGENT = os.environ.get('FETCH_USER_AGENT', 'Mozilla/5.0 (compatible; MiniBookmark/1.0)')
+HTTP_TIMEOUT = float(os.environ.get('FETCH_HTTP_TIMEOUT', 10))
+MIN_TEXT_LENGTH = int(os.environ.get('FETCH_MIN_TEXT_LENGTH', 500))
+JS_DOMAIN_TTL = int(os.environ.get('FETCH_JS_DOMAIN_TTL', 7 * 24 * 3600))
+
+JS_SHELL_MARKERS = re.compile(
+    r'enable javascript|javascript is (?:required|disabled)|requires javascript|'
+    r'turn on javascript|javascript must be enabled|please enable js',
+    re.IGNORECASE,
+)
+SPA_ROOT_IDS = ('root', 'app', '__next', '__nuxt', 'svelte', 'main-app', 'app-root')
+
+http_session = requests.Session()
+http_session.headers.update({'User-Agent': USER_AGENT})
+http_session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=20))
+http_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=20))
+
+# Domains whose pages needed a headless render, with the time the decision expires
+_js_domains = {}
+_js_domains_lock = threading.Lock()
+
+
+def get_domain(url):
+    return urlsplit(url).netloc.lower()
+
+
+def needs_js(url):
+    domain = get_domain(url)
+    with _js_domains_lock:
+        expires = _js_domains.get(domain)
+        if expires is None:
+            return False
+        if expires < time.time():
+            del _js_domains[domain]
+            return False
+        return True
+
+
+def remember_js_domain(url):
+    with _js_domains_lock:
+        _js_domains[get_domain(url)] = time.time() + JS_DOMAIN_TTL
+
+
+def fetch_url_plain(url, headers=None):
+    return http_session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+
+
+def is_html_response(response):
+    return (response.status_code == 200
+            and 'html' in response.headers.get('Content-Type', 'text/html')
+            and bool(response.content.strip()))
+
+
+def is_usable_html(doc):
+    # Empty SPA mount point, e.g. <div id="root"></div>
+    for root_id in SPA_ROOT_IDS:
+        mount = doc.element_by_id(root_id)
+        if mount is not None and doc.is_empty(mount):
+            return False
+
+    text = doc.visible_text()
+    # "Please enable JavaScript" shell pages
+    if JS_SHELL_MARKERS.search(text) and len(text) < MIN_TEXT_LENGTH * 4:
+        return False
+
+    return len(text) >= MIN_TEXT_LENGTH
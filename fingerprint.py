@@ -0,0 +1,103 @@
+import hashlib
+import os
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+# Copies within this Hamming distance are near-duplicates. With 4 bands of
+# 16 bits, any two hashes this close share at least one band exactly.
+SIMHASH_DISTANCE = int(os.environ.get('SIMHASH_DISTANCE', 3))
+
+TRACKING_PARAMS = re.compile(
+    r'^(utm_\w+|fbclid|gclid|dclid|msclkid|mc_cid|mc_eid|igshid|_ga|_gl|yclid|ref_src|ref_url|'
+    r'cmpid|s_cid|amp)$',
+    re.IGNORECASE,
+)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonicalize_url(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if host.startswith('amp.'):
+        host = host[4:]
+    netloc = host
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{parts.port}"
+
+    path = re.sub(r'/+', '/', parts.path or '/')
+    # AMP variants: /amp, /amp/, /amp.html and /amp/ path prefixes
+    path = re.sub(r'(/amp(\.html)?)+/?$', '/', path)
+    path = re.sub(r'^/amp/', '/', path)
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not TRACKING_PARAMS.match(k))
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+
+def _tokens(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def simhash(text, shingle_size=3):
+    import numpy as np
+
+    tokens = _tokens(text)
+    if not tokens:
+        return None
+    if len(tokens) >= shingle_size:
+        features = (' '.join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1))
+    else:
+        features = [' '.join(tokens)]
+    digests = b''.join(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest() for feature in features)
+    # One row of 64 bits per feature, most significant bit first; each bit is set
+    # in the result when more than half of the features have it set
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(-1, SIMHASH_BITS)
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(bits)
+    return f"{int(''.join('1' if bit else '0' for bit in majority), 2):016x}"
+
+
+def html_simhash(html_content):
+    return simhash(re.sub(r'<[^>]+>', ' ', html_content or ''))
+
+
+def simhash_bands(value):
+    # LSH bucket keys: the hash split into SIMHASH_BANDS fixed bit ranges
+    if not value:
+        return []
+    width = SIMHASH_BITS // SIMHASH_BANDS // 4
+    return [f"{i}:{value[i * width:(i + 1) * width]}" for i in range(SIMHASH_BANDS)]
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def find_duplicates(db, username, canonical_url, value, exclude_id=None, limit=50):
+    # Candidates come only from the user's matching LSH buckets and canonical
+    # URL, so this stays cheap however many bookmarks the user has
+    clauses = [{'canonical_url': canonical_url}]
+    if value:
+        clauses.append({'simhash_bands': {'$in': simhash_bands(value)}})
+    query = {'username': username, '$or': clauses}
+    if exclude_id is not None:
+        query['_id'] = {'$ne': exclude_id}
+    duplicates = []
+    for candidate in db.bookmarks.find(query, {'title': 1, 'url': 1, 'canonical_url': 1, 'simhash': 1}).limit(limit):
+        if candidate.get('canonical_url') == canonical_url:
+            distance = 0
+        elif value and candidate.get('simhash'):
+            distance = hamming(value, candidate['simhash'])
+            if distance > SIMHASH_DISTANCE:
+                continue
+        else:
+            continue
+        duplicates.append({'_id': str(candidate['_id']), 'title': candidate.get('title', ''),
+                           'url': candidate.get('url', ''), 'distance': distance})
+    return sorted(duplicates, key=lambda d: d['distance'])
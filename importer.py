@@ -0,0 +1,221 @@
+import asyncio
+import io
+import json
+import os
+import threading
+from datetime import datetime
+from html.parser import HTMLParser
+from bson import ObjectId
+import content_store
+import fingerprint
+import refresher
+import versions
+from content_cache import content_cache
+
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 4))
+IMPORT_READ_SIZE = 64 * 1024
+
+
+class NetscapeBookmarkParser(HTMLParser):
+    # Collects <A HREF=...>title</A> entries from a Netscape bookmarks export
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.records = []
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            attrs = dict(attrs)
+            if attrs.get('href'):
+                self._current = {'url': attrs['href'], 'title': ''}
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current['title'] += data
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._current is not None:
+            self._current['title'] = self._current['title'].strip()
+            self.records.append(self._current)
+            self._current = None
+
+
+def iter_netscape_html(text_stream):
+    parser = NetscapeBookmarkParser()
+    while True:
+        chunk = text_stream.read(IMPORT_READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from parser.records
+        parser.records = []
+    parser.close()
+    yield from parser.records
+
+
+def iter_jsonl(text_stream):
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get('url'):
+            yield {'url': record['url'], 'title': record.get('title', '')}
+
+
+def detect_format(filename, requested=None):
+    if requested in ('html', 'jsonl'):
+        return requested
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return 'html'
+
+
+def import_stream(db, username, binary_stream, file_format):
+    # Streams the upload into bare bookmark records, inserted in batches, and
+    # returns the id of the import job that tracks their enrichment
+    job_id = db.import_jobs.insert_one({
+        'username': username,
+        'status': 'parsing',
+        'format': file_format,
+        'total': 0,
+        'enriched': 0,
+        'failed': 0,
+        'created_at': datetime.utcnow(),
+        'updated_at': datetime.utcnow(),
+    }).inserted_id
+
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8', errors='replace')
+    records = iter_jsonl(text_stream) if file_format == 'jsonl' else iter_netscape_html(text_stream)
+    batch = []
+    total = 0
+    try:
+        for record in records:
+            if not record['url'].startswith(('http://', 'https://')):
+                continue
+            batch.append({
+                'username': username,
+                'url': record['url'],
+                'canonical_url': fingerprint.canonicalize_url(record['url']),
+                'title': record['title'] or record['url'],
+                'type': 'unknown',
+                # Stored as a string so bookmarks stay JSON serializable
+                'import_job_id': str(job_id),
+                'enrichment': 'pending',
+            })
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                db.bookmarks.insert_many(batch, ordered=False)
+                versions.bump(db, username)
+                total += len(batch)
+                batch = []
+                db.import_jobs.update_one({'_id': job_id}, {'$set': {'total': total, 'updated_at': datetime.utcnow()}})
+        if batch:
+            db.bookmarks.insert_many(batch, ordered=False)
+            versions.bump(db, username)
+            total += len(batch)
+    except Exception as e:
+        print(f"Error importing bookmarks: {str(e)}")
+        db.import_jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'failed', 'error': str(e), 'total': total, 'updated_at': datetime.utcnow()}})
+        raise
+
+    db.import_jobs.update_one({'_id': job_id}, {'$set': {
+        'status': 'enriching' if total else 'done', 'total': total, 'updated_at': datetime.utcnow()}})
+    return job_id, total
+
+
+def enrichment_update(result):
+    if result.get('type') == 'article':
+        update = {'title': result['title'], 'type': 'article', 'summary': result['summary']}
+    else:
+        update = {'title': result['title'], 'type': 'list', 'links': result['links']}
+    if result.get('simhash'):
+        update['simhash'] = result['simhash']
+        update['simhash_bands'] = fingerprint.simhash_bands(result['simhash'])
+    return update
+
+
+class EnrichmentPool:
+    # Fills in imported bookmarks through the fetch pipeline on a background
+    # loop, with at most IMPORT_WORKERS fetches in flight across all jobs.
+    def __init__(self, workers=IMPORT_WORKERS):
+        self.workers = max(1, workers)
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='import-enrichment', daemon=True).start()
+        return self._loop
+
+    def submit(self, db, job_id, fetch_content):
+        return asyncio.run_coroutine_threadsafe(self._enrich_job(db, job_id, fetch_content), self._ensure_loop())
+
+    async def _enrich_one(self, db, bookmark, job_id, fetch_content):
+        loop = asyncio.get_running_loop()
+        try:
+            # Imports queue under their own name, so the user's interactive fetches interleave with them
+            result = await fetch_content(bookmark['url'], user=f"{bookmark['username']}:import")
+            if result.get('type') == 'error':
+                raise RuntimeError(result.get('error', 'Fetch failed'))
+            content_hash = await loop.run_in_executor(None, content_store.store_content, db, result)
+            update = dict(enrichment_update(result), enrichment='done', content_hash=content_hash)
+            cached = await content_cache.get_async(fingerprint.canonicalize_url(bookmark['url']))
+            if cached is not None:
+                update.update(refresher.refresh_schedule(etag=cached.etag, last_modified=cached.last_modified))
+            counter = 'enriched'
+        except Exception as e:
+            update = {'enrichment': 'failed', 'enrichment_error': str(e)}
+            counter = 'failed'
+        await loop.run_in_executor(None, lambda: db.bookmarks.update_one({'_id': bookmark['_id']}, {'$set': update}))
+        await loop.run_in_executor(None, versions.bump, db, bookmark['username'])
+        await loop.run_in_executor(None, lambda: db.import_jobs.update_one(
+            {'_id': job_id}, {'$inc': {counter: 1}, '$set': {'updated_at': datetime.utcnow()}}))
+
+    async def _enrich_job(self, db, job_id, fetch_content):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+        loop = asyncio.get_running_loop()
+        cursor = db.bookmarks.find({'import_job_id': str(job_id), 'enrichment': 'pending'},
+                                   {'url': 1, 'username': 1}).batch_size(IMPORT_BATCH_SIZE)
+        tasks = set()
+        try:
+            while True:
+                bookmark = await loop.run_in_executor(None, next, cursor, None)
+                if bookmark is None:
+                    break
+                # Acquire before creating the task so only a bounded number of fetches exist at once
+                await self._semaphore.acquire()
+                task = loop.create_task(self._enrich_one(db, bookmark, job_id, fetch_content))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: self._semaphore.release())
+            if tasks:
+                await asyncio.gather(*tasks)
+            status = {'status': 'done'}
+        except Exception as e:
+            print(f"Error enriching import {job_id}: {str(e)}")
+            status = {'status': 'failed', 'error': str(e)}
+        finally:
+            cursor.close()
+        await loop.run_in_executor(None, lambda: db.import_jobs.update_one(
+            {'_id': job_id}, {'$set': dict(status, updated_at=datetime.utcnow())}))
+
+
+enrichment_pool = EnrichmentPool()
+
+
+def job_status(db, job_id, username):
+    job = db.import_jobs.find_one({'_id': ObjectId(job_id), 'username': username})
+    if job is None:
+        return None
+    job['_id'] = str(job['_id'])
+    job['pending'] = max(0, job['total'] - job['enriched'] - job['failed'])
+    return job
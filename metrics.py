@@ -0,0 +1,144 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Stage timings of the current request, collected when it asked for X-Debug-Timing
+_trace = contextvars.ContextVar('metrics_trace', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    # In-process counters and latency histograms, rendered in the Prometheus text format
+    def __init__(self, prefix='bookmark'):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        # Times one pipeline stage; failures are counted by exception type and re-raised
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.inc('stage_errors_total', stage=stage, type=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe('stage_seconds', elapsed, stage=stage)
+            record_trace(stage, elapsed)
+
+    def render(self, gauges=None):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            snapshots = [(key, list(h.buckets), list(h.counts), h.sum, h.count) for key, h in histograms]
+        declared = set()
+        for (name, labels), value in counters:
+            metric = f'{self.prefix}_{name}'
+            if metric not in declared:
+                lines.append(f'# TYPE {metric} counter')
+                declared.add(metric)
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+        for (name, labels), buckets, counts, total, count in snapshots:
+            metric = f'{self.prefix}_{name}'
+            if metric not in declared:
+                lines.append(f'# TYPE {metric} histogram')
+                declared.add(metric)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{_format_labels(labels, [("le", f"{bound:g}")])} {cumulative}')
+            lines.append(f'{metric}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{metric}_sum{_format_labels(labels)} {total:.6f}')
+            lines.append(f'{metric}_count{_format_labels(labels)} {count}')
+        for name, value in sorted((gauges or {}).items()):
+            metric = f'{self.prefix}_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def start_trace():
+    trace = []
+    _trace.set(trace)
+    return trace
+
+
+def record_trace(stage, seconds):
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((stage, seconds))
+
+
+def format_trace(trace):
+    # Server-Timing syntax, so browser dev tools can display it too
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in trace)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # Times every MongoDB command the app sends, by command name
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        seconds = event.duration_micros / 1e6
+        self.metrics.observe('mongo_command_seconds', seconds, command=event.command_name)
+        record_trace(f'mongo.{event.command_name}', seconds)
+
+    def failed(self, event):
+        self.metrics.observe('mongo_command_seconds', event.duration_micros / 1e6, command=event.command_name)
+        self.metrics.inc('mongo_errors_total', command=event.command_name,
+                         type=(event.failure or {}).get('codeName', 'unknown'))
+
+
+metrics = Metrics()
@@ -0,0 +1,235 @@
+import asyncio
+import os
+import socket
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import content_store
+import fetcher
+import fingerprint
+import importer
+import versions
+from metrics import metrics
+from scheduler import scheduler
+
+# Seconds between sweeps; 0 turns background refreshing off
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 300))
+REFRESH_BATCH_SIZE = int(os.environ.get('REFRESH_BATCH_SIZE', 100))
+REFRESH_CONCURRENCY = int(os.environ.get('REFRESH_CONCURRENCY', 2))
+# Pages of any one host revisited per sweep
+REFRESH_HOST_LIMIT = int(os.environ.get('REFRESH_HOST_LIMIT', 5))
+# Bounds on how long a bookmark goes between visits; pages that change get
+# revisited more often, pages that don't less often
+REFRESH_MIN_AGE = int(os.environ.get('REFRESH_MIN_AGE', 6 * 3600))
+REFRESH_MAX_AGE = int(os.environ.get('REFRESH_MAX_AGE', 30 * 24 * 3600))
+REFRESH_INITIAL_AGE = max(REFRESH_MIN_AGE, min(24 * 3600, REFRESH_MAX_AGE))
+# All refresh fetches share one name in the scheduler's per-user rotation
+REFRESH_USER = 'refresh'
+LEASE_ID = 'bookmark-refresh'
+# Bookkeeping kept on each bookmark; not part of what users see
+REFRESH_STATE_FIELDS = ('page_etag', 'page_last_modified', 'refreshed_at', 'refresh_interval', 'next_refresh_at',
+                        'refresh_error')
+REFRESH_PROJECTION = {'username': 1, 'url': 1, 'canonical_url': 1, 'title': 1, 'type': 1, 'summary': 1, 'links': 1,
+                      'simhash': 1, 'simhash_bands': 1, 'content_hash': 1, 'page_etag': 1, 'page_last_modified': 1,
+                      'refresh_interval': 1, 'refresh_error': 1}
+
+
+def refresh_schedule(interval=REFRESH_INITIAL_AGE, etag=None, last_modified=None, now=None):
+    # Fields that record a visit to a bookmark's page and when to go back
+    now = now or datetime.utcnow()
+    return {
+        'page_etag': etag,
+        'page_last_modified': last_modified,
+        'refreshed_at': now,
+        'refresh_interval': interval,
+        'next_refresh_at': now + timedelta(seconds=interval),
+    }
+
+
+def due_bookmarks(db, now, limit):
+    # Never-visited bookmarks sort first, then the longest overdue
+    cursor = db.bookmarks.find({
+        '$or': [{'next_refresh_at': None}, {'next_refresh_at': {'$lte': now}}],
+        'enrichment': {'$ne': 'pending'},
+    }, REFRESH_PROJECTION).sort('next_refresh_at', 1).limit(limit)
+    return list(cursor)
+
+
+def plan_batch(bookmarks, batch_size=REFRESH_BATCH_SIZE, host_limit=REFRESH_HOST_LIMIT):
+    # Groups due bookmarks by page, so a page saved by several users is fetched
+    # once, and caps the pages taken from any one host. The rest wait for a later sweep.
+    pages = OrderedDict()
+    per_host = {}
+    for bookmark in bookmarks:
+        key = bookmark.get('canonical_url') or fingerprint.canonicalize_url(bookmark['url'])
+        if key in pages:
+            pages[key].append(bookmark)
+            continue
+        host = fetcher.get_domain(bookmark['url'])
+        if len(pages) >= batch_size or per_host.get(host, 0) >= host_limit:
+            continue
+        per_host[host] = per_host.get(host, 0) + 1
+        pages[key] = [bookmark]
+    return list(pages.values())
+
+
+def claim_lease(db, owner, seconds):
+    # Only one process sweeps at a time; the lease passes on if its owner stops renewing it
+    now = datetime.utcnow()
+    try:
+        db.leases.find_one_and_update(
+            {'_id': LEASE_ID, '$or': [{'owner': owner}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': owner, 'expires_at': now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def bookmark_update(bookmark, result, headers, now):
+    # Returns (update, outcome, content hash to release) for one bookmark of a
+    # refreshed page, setting only the fields whose values changed
+    interval = bookmark.get('refresh_interval') or REFRESH_INITIAL_AGE
+    update = {}
+    released = None
+    changed = False
+    if result is not None:
+        fields = importer.enrichment_update(result)
+        changes = {field: value for field, value in fields.items() if bookmark.get(field) != value}
+        content_hash, _ = content_store.encode_content(result)
+        changed = bool(changes) or (bookmark.get('content_hash') not in (None, content_hash))
+        if content_hash != bookmark.get('content_hash'):
+            changes['content_hash'] = content_hash
+            released = bookmark.get('content_hash')
+        update['$set'] = changes
+        # A page that turned from an article into a list, or back, drops the other kind's field
+        stale = 'links' if fields['type'] == 'article' else 'summary'
+        if stale in bookmark:
+            update['$unset'] = {stale: ''}
+    interval = max(REFRESH_MIN_AGE, interval // 2) if changed else min(REFRESH_MAX_AGE, interval * 2)
+    etag, last_modified = headers.get('etag'), headers.get('last-modified')
+    if result is None:
+        # A 304 need not repeat the validators it confirmed
+        etag = etag or bookmark.get('page_etag')
+        last_modified = last_modified or bookmark.get('page_last_modified')
+    update.setdefault('$set', {}).update(refresh_schedule(interval, etag, last_modified, now))
+    if 'refresh_error' in bookmark:
+        update.setdefault('$unset', {})['refresh_error'] = ''
+    if result is None:
+        outcome = 'not_modified'
+    else:
+        outcome = 'changed' if changed else 'unchanged'
+    return update, outcome, released
+
+
+class BookmarkRefresher:
+    # Revisits saved bookmarks in the background on a loop of its own. Each
+    # sweep takes one batch of due bookmarks, revalidates their pages with
+    # conditional requests, and applies the changed fields in one bulk write.
+    # Refresh fetches go through the politeness scheduler like any other, stay
+    # within REFRESH_CONCURRENCY, and hold back while interactive fetches queue.
+    def __init__(self, interval=REFRESH_INTERVAL, batch_size=REFRESH_BATCH_SIZE,
+                 concurrency=REFRESH_CONCURRENCY, host_limit=REFRESH_HOST_LIMIT):
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.host_limit = max(1, host_limit)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._future = None
+        self._lock = threading.Lock()
+
+    def start(self, db, refresh_page):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._future is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='bookmark-refresh', daemon=True).start()
+            self._future = asyncio.run_coroutine_threadsafe(self._run(db, refresh_page), loop)
+
+    async def _run(self, db, refresh_page):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if await loop.run_in_executor(None, claim_lease, db, self.owner, self.interval * 3):
+                    await self.refresh_batch(db, refresh_page)
+            except Exception as e:
+                print(f"Error refreshing bookmarks: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def refresh_batch(self, db, refresh_page):
+        loop = asyncio.get_running_loop()
+        now = datetime.utcnow()
+        # Read ahead so bookmarks of hosts over their limit can be skipped without shrinking the batch
+        bookmarks = await loop.run_in_executor(None, due_bookmarks, db, now, self.batch_size * 4)
+        pages = plan_batch(bookmarks, self.batch_size, self.host_limit)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh_one(page_bookmarks):
+            async with semaphore:
+                # Interactive fetches waiting for a slot go first
+                while scheduler.stats()['waiting']:
+                    await asyncio.sleep(0.5)
+                return await self._refresh_page(db, page_bookmarks, refresh_page, now)
+
+        operations = []
+        released = []
+        changed_users = set()
+        for page_operations, page_released, page_users in await asyncio.gather(*(refresh_one(page) for page in pages)):
+            operations.extend(page_operations)
+            released.extend(page_released)
+            changed_users.update(page_users)
+        if operations:
+            await loop.run_in_executor(None, lambda: db.bookmarks.bulk_write(operations, ordered=False))
+        if changed_users:
+            await loop.run_in_executor(None, versions.bump, db, *changed_users)
+        for content_hash in released:
+            await loop.run_in_executor(None, content_store.release_content, db, content_hash)
+        if pages:
+            print(f"Refreshed {len(pages)} pages for {len(operations)} bookmarks")
+        return len(pages)
+
+    async def _refresh_page(self, db, bookmarks, refresh_page, now):
+        loop = asyncio.get_running_loop()
+        first = bookmarks[0]
+        etag = last_modified = None
+        # A 304 only vouches for every bookmark of the page if they all hold the same content
+        if all(bookmark.get('content_hash') == first.get('content_hash') for bookmark in bookmarks):
+            etag, last_modified = first.get('page_etag'), first.get('page_last_modified')
+        try:
+            result, headers = await refresh_page(first['url'], etag, last_modified, REFRESH_USER)
+        except Exception as e:
+            metrics.inc('refresh_total', outcome='error')
+            metrics.inc('refresh_errors_total', type=type(e).__name__)
+            # Back off as if unchanged and keep the validators for the next attempt
+            operations = []
+            for bookmark in bookmarks:
+                interval = min(REFRESH_MAX_AGE, (bookmark.get('refresh_interval') or REFRESH_INITIAL_AGE) * 2)
+                schedule = refresh_schedule(interval, bookmark.get('page_etag'), bookmark.get('page_last_modified'),
+                                            now)
+                operations.append(UpdateOne({'_id': bookmark['_id']}, {'$set': dict(schedule, refresh_error=str(e))}))
+            return operations, [], []
+
+        operations = []
+        released = []
+        changed_users = []
+        for bookmark in bookmarks:
+            update, outcome, old_hash = bookmark_update(bookmark, result, headers, now)
+            new_hash = update['$set'].get('content_hash')
+            if new_hash:
+                # Takes this bookmark's reference on the new content before the old one is released
+                await loop.run_in_executor(None, content_store.store_content, db, result)
+            if old_hash:
+                released.append(old_hash)
+            operations.append(UpdateOne({'_id': bookmark['_id']}, update))
+            metrics.inc('refresh_total', outcome=outcome)
+            if set(update['$set']).union(update.get('$unset', ())).difference(REFRESH_STATE_FIELDS):
+                changed_users.append(bookmark['username'])
+        return operations, released, changed_users
+
+
+bookmark_refresher = BookmarkRefresher()
@@ -0,0 +1,116 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+import robotexclusionrulesparser
+from fetcher import http_session
+
+ROBOTS_TTL = int(os.environ.get('ROBOTS_TTL', 24 * 3600))
+ROBOTS_NEGATIVE_TTL = int(os.environ.get('ROBOTS_NEGATIVE_TTL', 600))
+ROBOTS_MAX_TTL = int(os.environ.get('ROBOTS_MAX_TTL', 7 * 24 * 3600))
+ROBOTS_CACHE_SIZE = int(os.environ.get('ROBOTS_CACHE_SIZE', 2000))
+ROBOTS_TIMEOUT = float(os.environ.get('ROBOTS_TIMEOUT', 5))
+ROBOTS_USER_AGENT = '*'
+
+
+class RobotsEntry:
+    def __init__(self, parser, expires_at, status):
+        self.parser = parser
+        self.expires_at = expires_at
+        # HTTP status of the robots.txt response, or None when the fetch failed
+        self.status = status
+
+    def is_allowed(self, url, user_agent=ROBOTS_USER_AGENT):
+        return self.parser.is_allowed(user_agent, url)
+
+    def crawl_delay(self, user_agent=ROBOTS_USER_AGENT):
+        return self.parser.get_crawl_delay(user_agent)
+
+
+def _expiry_from_headers(headers, now):
+    cache_control = headers.get('Cache-Control', '')
+    if 'no-store' in cache_control or 'no-cache' in cache_control:
+        return now
+    match = re.search(r'max-age=(\d+)', cache_control)
+    if match:
+        return now + min(int(match.group(1)), ROBOTS_MAX_TTL)
+    if headers.get('Expires'):
+        try:
+            expires = parsedate_to_datetime(headers['Expires']).timestamp()
+            return min(expires, now + ROBOTS_MAX_TTL)
+        except (TypeError, ValueError):
+            pass
+    return now + ROBOTS_TTL
+
+
+class RobotsCache:
+    def __init__(self, max_entries=ROBOTS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._domain_locks = {}
+
+    def _site(self, url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc.lower()}"
+
+    def _download(self, site):
+        robots_url = f"{site}/robots.txt"
+        print(f"Checking robots.txt at: {robots_url}")
+        parser = robotexclusionrulesparser.RobotExclusionRulesParser()
+        now = time.time()
+        try:
+            response = http_session.get(robots_url, timeout=ROBOTS_TIMEOUT)
+        except requests.RequestException as e:
+            # Unreachable robots.txt: allow, but retry soon
+            print(f"Could not fetch {robots_url}: {str(e)}")
+            parser.parse('')
+            return RobotsEntry(parser, now + ROBOTS_NEGATIVE_TTL, None)
+
+        if response.status_code in (401, 403):
+            parser.parse('User-agent: *\nDisallow: /')
+            return RobotsEntry(parser, now + ROBOTS_NEGATIVE_TTL, response.status_code)
+        if response.status_code >= 400:
+            parser.parse('')
+            ttl = ROBOTS_TTL if response.status_code < 500 else ROBOTS_NEGATIVE_TTL
+            return RobotsEntry(parser, now + ttl, response.status_code)
+
+        parser.parse(response.text)
+        return RobotsEntry(parser, _expiry_from_headers(response.headers, now), response.status_code)
+
+    def get(self, url):
+        site = self._site(url)
+        with self._lock:
+            entry = self._entries.get(site)
+            if entry is not None and entry.expires_at > time.time():
+                self._entries.move_to_end(site)
+                return entry
+            domain_lock = self._domain_locks.setdefault(site, threading.Lock())
+
+        # Only one thread downloads a given site's robots.txt at a time
+        with domain_lock:
+            with self._lock:
+                entry = self._entries.get(site)
+                if entry is not None and entry.expires_at > time.time():
+                    return entry
+            entry = self._download(site)
+            with self._lock:
+                self._entries[site] = entry
+                self._entries.move_to_end(site)
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._domain_locks.pop(evicted, None)
+            return entry
+
+    def is_allowed(self, url):
+        return self.get(url).is_allowed(url)
+
+    def crawl_delay(self, url):
+        return self.get(url).crawl_delay()
+
+
+robots_cache = RobotsCache()
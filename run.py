@@ -1,14 +1,118 @@
 import asyncio
-from app import app
-from telegram_bot import main as run_bot
+import multiprocessing
+import os
+import threading
+import time
+import uvicorn
+from dotenv import load_dotenv
 
-async def run_flask():
-    app.run(debug=True, use_reloader=False)
+load_dotenv()
+
+WEB_HOST = os.environ.get('WEB_HOST', '127.0.0.1')
+WEB_PORT = int(os.environ.get('WEB_PORT', 5000))
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', 1))
+# 'task' runs the bot in the web server's process, 'process' in a process of
+# its own, 'off' not at all. More than one web worker implies 'process'.
+BOT_MODE = os.environ.get('BOT_MODE', 'task')
+BOT_RESTART_MAX_DELAY = 60
+
+
+def local_client():
+    from app import mongo, fetch_content
+    from bot_client import LocalClient
+    # Co-located with the web app, the bot calls the service layer directly
+    return LocalClient(mongo.db, fetch_content)
+
+
+async def supervise(name, start):
+    # Restarts a crashed task with exponential backoff; cancellation stops it for good
+    delay = 1
+    while True:
+        started = time.monotonic()
+        try:
+            await start()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if time.monotonic() - started > BOT_RESTART_MAX_DELAY:
+                delay = 1
+            print(f"{name} stopped with an error: {str(e)}; restarting in {delay} s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BOT_RESTART_MAX_DELAY)
+
+
+def bot_process():
+    import telegram_bot
+    telegram_bot.main(local_client())
+
+
+def supervise_process(target, stopping):
+    # Keeps the bot process running next to a multi-worker web server
+    delay = 1
+    while not stopping.is_set():
+        process = multiprocessing.Process(target=target, name='telegram-bot')
+        process.start()
+        started = time.monotonic()
+        while process.is_alive() and not stopping.is_set():
+            process.join(1)
+        if stopping.is_set():
+            if process.is_alive():
+                process.terminate()
+                process.join(10)
+            return
+        if time.monotonic() - started > BOT_RESTART_MAX_DELAY:
+            delay = 1
+        print(f"Bot process exited with code {process.exitcode}; restarting in {delay} s")
+        stopping.wait(delay)
+        delay = min(delay * 2, BOT_RESTART_MAX_DELAY)
+
+
+class Server(uvicorn.Server):
+    # uvicorn re-raises SIGINT/SIGTERM once serve() returns, so tasks sharing
+    # the process are stopped as part of its shutdown, after the connections drain
+    def __init__(self, config, tasks=()):
+        super().__init__(config)
+        self.tasks = list(tasks)
+
+    async def shutdown(self, sockets=None):
+        await super().shutdown(sockets)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+async def serve_with_bot():
+    import asgi
+    import telegram_bot
+
+    tasks = []
+    if BOT_MODE == 'task' and telegram_bot.TOKEN:
+        tasks.append(asyncio.create_task(supervise('Telegram bot', lambda: telegram_bot.run(local_client()))))
+    server = Server(uvicorn.Config(asgi.application, host=WEB_HOST, port=WEB_PORT, lifespan='off'), tasks)
+    await server.serve()
+
+
+def main():
+    if WEB_WORKERS <= 1 and BOT_MODE != 'process':
+        try:
+            asyncio.run(serve_with_bot())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    stopping = threading.Event()
+    supervisor = None
+    if BOT_MODE != 'off' and os.environ.get('TELEGRAM_BOT_TOKEN'):
+        supervisor = threading.Thread(target=supervise_process, args=(bot_process, stopping), daemon=True)
+        supervisor.start()
+    try:
+        uvicorn.run('asgi:application', host=WEB_HOST, port=WEB_PORT, workers=WEB_WORKERS, lifespan='off')
+    finally:
+        stopping.set()
+        if supervisor is not None:
+            supervisor.join(15)
 
-async def main():
-    flask_task = asyncio.create_task(run_flask())
-    bot_task = asyncio.create_task(run_bot())
-    await asyncio.gather(flask_task, bot_task)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    main()
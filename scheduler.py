@@ -0,0 +1,150 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import fetcher
+from metrics import metrics
+
+FETCH_MAX_CONCURRENCY = int(os.environ.get('FETCH_MAX_CONCURRENCY', 16))
+FETCH_HOST_CONCURRENCY = int(os.environ.get('FETCH_HOST_CONCURRENCY', 2))
+# Minimum seconds between the starts of two fetches to one host; robots.txt
+# Crawl-delay raises it, up to FETCH_MAX_CRAWL_DELAY
+FETCH_HOST_INTERVAL = float(os.environ.get('FETCH_HOST_INTERVAL', 1.0))
+FETCH_MAX_CRAWL_DELAY = float(os.environ.get('FETCH_MAX_CRAWL_DELAY', 30))
+
+
+class HostState:
+    def __init__(self):
+        self.active = 0
+        self.next_start = 0.0
+        self.interval = FETCH_HOST_INTERVAL
+        # user -> waiting (loop, future) pairs, served round-robin
+        self.users = OrderedDict()
+
+
+class FetchScheduler:
+    # Grants network fetch slots to coroutines on any event loop. A dispatcher
+    # thread hands out slots host by host and user by user in rotation, within
+    # a global cap, a per-host cap and a minimum spacing per host.
+    def __init__(self, max_concurrency=FETCH_MAX_CONCURRENCY, host_concurrency=FETCH_HOST_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.host_concurrency = max(1, host_concurrency)
+        self._hosts = OrderedDict()
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='fetch-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                self._cond.wait(self._dispatch())
+
+    def _dispatch(self):
+        # Returns how long to sleep before a spaced-out host becomes eligible, or None
+        now = time.monotonic()
+        next_wake = None
+        progressed = True
+        while progressed and self._active < self.max_concurrency:
+            progressed = False
+            for host in list(self._hosts):
+                if self._active >= self.max_concurrency:
+                    break
+                state = self._hosts[host]
+                if not state.users:
+                    if state.active == 0 and state.next_start <= now:
+                        del self._hosts[host]
+                    continue
+                if state.active >= self.host_concurrency:
+                    continue
+                if state.next_start > now:
+                    wait = state.next_start - now
+                    next_wake = wait if next_wake is None else min(next_wake, wait)
+                    continue
+                user, waiters = next(iter(state.users.items()))
+                loop, future = waiters.popleft()
+                if waiters:
+                    state.users.move_to_end(user)
+                else:
+                    del state.users[user]
+                self._hosts.move_to_end(host)
+                self._waiting -= 1
+                self._active += 1
+                state.active += 1
+                state.next_start = now + state.interval
+                self._grant(host, loop, future)
+                progressed = True
+        return next_wake
+
+    def _grant(self, host, loop, future):
+        def resolve():
+            if future.cancelled():
+                self.release(host)
+            else:
+                future.set_result(None)
+        try:
+            loop.call_soon_threadsafe(resolve)
+        except RuntimeError:
+            # The waiting loop has closed
+            self.release(host)
+
+    async def acquire(self, host, user=None, crawl_delay=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (loop, future)
+        with self._cond:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = HostState()
+            state.interval = max(FETCH_HOST_INTERVAL, min(crawl_delay or 0, FETCH_MAX_CRAWL_DELAY))
+            state.users.setdefault(user, deque()).append(entry)
+            self._waiting += 1
+            self._ensure_thread()
+            self._cond.notify()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted, but cancelled before this task resumed: the slot is ours to give back
+                self.release(host)
+                raise
+            with self._cond:
+                waiters = state.users.get(user)
+                if waiters and entry in waiters:
+                    waiters.remove(entry)
+                    self._waiting -= 1
+                    if not waiters:
+                        del state.users[user]
+            raise
+
+    def release(self, host):
+        with self._cond:
+            self._active -= 1
+            state = self._hosts.get(host)
+            if state is not None:
+                state.active -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def slot(self, url, user=None, crawl_delay=None):
+        host = fetcher.get_domain(url)
+        with metrics.span('schedule_wait'):
+            await self.acquire(host, user, crawl_delay)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    def stats(self):
+        with self._cond:
+            return {'active': self._active, 'waiting': self._waiting, 'hosts': len(self._hosts)}
+
+
+scheduler = FetchScheduler()
@@ -0,0 +1,221 @@
+import asyncio
+from bson import ObjectId
+from bson.errors import InvalidId
+from werkzeug.security import generate_password_hash, check_password_hash
+from content_cache import content_cache
+import content_store
+import fingerprint
+import refresher
+import versions
+
+PAGE_SIZE_DEFAULT = 20
+PAGE_SIZE_MAX = 100
+BOOKMARK_FIELDS = ('url', 'title', 'type', 'summary', 'links')
+HIDDEN_FIELDS = {field: 0 for field in refresher.REFRESH_STATE_FIELDS}
+
+# The bookmark, auth and fetch operations behind both the HTTP routes and the
+# co-located Telegram bot. Callers pass the database and the signed-in
+# username; anything that fetches pages takes the fetch pipeline as an argument.
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _object_id(value, message='Bookmark not found'):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ServiceError(404, message)
+
+
+def signup(db, username, password):
+    if not username or not password:
+        raise ServiceError(400, "Username and password are required")
+    if db.users.find_one({"username": username}):
+        raise ServiceError(400, "Username already exists")
+
+    db.users.insert_one({"username": username, "password": generate_password_hash(password)})
+    return {"success": True, "username": username}
+
+
+def login(db, username, password):
+    user = db.users.find_one({"username": username})
+    if user and check_password_hash(user['password'], password or ''):
+        return {"success": True, "username": username}
+    raise ServiceError(401, "Invalid username or password")
+
+
+async def fetch(fetch_content, username, url, refresh=False, link_limit=None):
+    options = {'refresh': refresh, 'user': username}
+    if link_limit is not None:
+        options['link_limit'] = link_limit
+    return await fetch_content(url, **options)
+
+
+def save_bookmark(db, username, data):
+    bookmark_data = {
+        'username': username,
+        'url': data.get('url', ''),
+        'title': data.get('title', ''),
+        'type': data.get('type', 'unknown')
+    }
+    if bookmark_data['type'] == 'article':
+        bookmark_data['summary'] = data.get('summary', '')
+    elif bookmark_data['type'] == 'list':
+        bookmark_data['links'] = data.get('links', [])
+
+    bookmark_data['canonical_url'] = fingerprint.canonicalize_url(bookmark_data['url'])
+    cached = content_cache.get(bookmark_data['canonical_url'])
+    if cached is not None and cached.result.get('type') == 'error':
+        cached = None
+    if cached is not None and cached.result.get('simhash'):
+        bookmark_data['simhash'] = cached.result['simhash']
+        bookmark_data['simhash_bands'] = fingerprint.simhash_bands(cached.result['simhash'])
+
+    # Near-duplicates share the canonical URL or an LSH band with this save
+    duplicates = fingerprint.find_duplicates(db, username, bookmark_data['canonical_url'],
+                                             bookmark_data.get('simhash'))
+    if duplicates and data.get('on_duplicate') == 'merge':
+        return {'success': True, 'merged': True, 'bookmark_id': duplicates[0]['_id'], 'duplicates': duplicates}
+    if duplicates:
+        bookmark_data['duplicate_of'] = duplicates[0]['_id']
+
+    # Keep the extracted page the server just fetched so reads don't go back to the network
+    if cached is not None:
+        bookmark_data['content_hash'] = content_store.store_content(db, cached.result)
+        if cached.result.get('content_type'):
+            bookmark_data['content_type'] = cached.result['content_type']
+        # The background refresher revalidates the page with the validators of this fetch
+        bookmark_data.update(refresher.refresh_schedule(etag=cached.etag, last_modified=cached.last_modified))
+
+    bookmark_id = db.bookmarks.insert_one(bookmark_data).inserted_id
+    versions.bump(db, username)
+    return {'success': True, 'bookmark_id': str(bookmark_id), 'duplicates': duplicates}
+
+
+def list_bookmarks(db, username, fields=None, limit=None, after=None, before=None):
+    projection = HIDDEN_FIELDS
+    if fields:
+        projection = {field: 1 for field in fields.split(',') if field in BOOKMARK_FIELDS}
+    query = {'username': username}
+
+    # Without paging parameters the full list is returned, as the web UI expects
+    if limit is None and after is None and before is None:
+        bookmarks = list(db.bookmarks.find(query, projection).sort('_id', -1))
+        for bookmark in bookmarks:
+            bookmark['_id'] = str(bookmark['_id'])  # Convert ObjectId to string
+        return bookmarks
+
+    try:
+        limit = max(1, min(int(limit or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX))
+        after = ObjectId(after) if after else None
+        before = ObjectId(before) if before else None
+    except (TypeError, ValueError, InvalidId):
+        raise ServiceError(400, "Invalid paging parameters")
+
+    # Keyset pagination on _id, newest first: 'after' pages towards older
+    # bookmarks and 'before' towards newer ones
+    if before is not None:
+        query['_id'] = {'$gt': before}
+        direction = 1
+    else:
+        if after is not None:
+            query['_id'] = {'$lt': after}
+        direction = -1
+    bookmarks = list(db.bookmarks.find(query, projection).sort('_id', direction).limit(limit + 1))
+    has_more = len(bookmarks) > limit
+    bookmarks = bookmarks[:limit]
+    if before is not None:
+        bookmarks.reverse()
+
+    next_cursor = prev_cursor = None
+    if bookmarks:
+        if before is not None or has_more:
+            next_cursor = str(bookmarks[-1]['_id'])
+        if after is not None or (before is not None and has_more):
+            prev_cursor = str(bookmarks[0]['_id'])
+    for bookmark in bookmarks:
+        bookmark['_id'] = str(bookmark['_id'])
+    return {'bookmarks': bookmarks, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+def search_bookmarks(db, username, terms, limit=None, page=None):
+    terms = (terms or '').strip()
+    if not terms:
+        raise ServiceError(400, "Missing search terms")
+    try:
+        limit = max(1, min(int(limit or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX))
+        page = max(1, int(page or 1))
+    except (TypeError, ValueError):
+        raise ServiceError(400, "Invalid paging parameters")
+
+    # Served by the (username, text) index; ranked by relevance
+    score = {'$meta': 'textScore'}
+    cursor = db.bookmarks.find(
+        {'username': username, '$text': {'$search': terms}},
+        {'title': 1, 'url': 1, 'type': 1, 'score': score},
+    ).sort([('score', score)]).skip((page - 1) * limit).limit(limit + 1)
+    results = list(cursor)
+    has_more = len(results) > limit
+    results = results[:limit]
+    for result in results:
+        result['_id'] = str(result['_id'])
+    return {'results': results, 'page': page, 'has_more': has_more}
+
+
+def get_bookmark(db, username, bookmark_id):
+    bookmark = db.bookmarks.find_one({'_id': _object_id(bookmark_id), 'username': username}, HIDDEN_FIELDS)
+    if not bookmark:
+        raise ServiceError(404, "Bookmark not found")
+    bookmark['_id'] = str(bookmark['_id'])  # Convert ObjectId to string
+    return bookmark
+
+
+def _load_bookmark_content(db, username, bookmark_id):
+    bookmark = db.bookmarks.find_one({'_id': _object_id(bookmark_id), 'username': username},
+                                     {'url': 1, 'title': 1, 'content_hash': 1})
+    if not bookmark:
+        raise ServiceError(404, "Bookmark not found")
+    content = content_store.load_content(db, bookmark['content_hash']) if bookmark.get('content_hash') else None
+    return bookmark, content
+
+
+def _store_bookmark_content(db, username, bookmark, content):
+    content_hash = content_store.store_content(db, content)
+    update = {'content_hash': content_hash}
+    if content.get('simhash'):
+        update['simhash'] = content['simhash']
+        update['simhash_bands'] = fingerprint.simhash_bands(content['simhash'])
+    db.bookmarks.update_one({'_id': bookmark['_id']}, {'$set': update})
+    versions.bump(db, username)
+
+
+async def get_bookmark_content(db, username, bookmark_id, fetch_content):
+    # Database calls and decoding run in the executor so callers' loops keep serving
+    loop = asyncio.get_running_loop()
+    bookmark, content = await loop.run_in_executor(None, _load_bookmark_content, db, username, bookmark_id)
+    if content is None:
+        # Saved before content was stored: fetch it once and keep it
+        content = await fetch_content(bookmark['url'], user=username)
+        if content.get('type') == 'error':
+            raise ServiceError(502, content.get('error', 'Fetch failed'))
+        await loop.run_in_executor(None, _store_bookmark_content, db, username, bookmark, content)
+    content['url'] = bookmark['url']
+    content['bookmark_id'] = str(bookmark['_id'])
+    return content
+
+
+def delete_bookmark(db, username, bookmark_id):
+    deleted = db.bookmarks.find_one_and_delete({
+        '_id': _object_id(bookmark_id, 'Bookmark not found or not authorized'),
+        'username': username
+    }, projection={'content_hash': 1})
+    if deleted is None:
+        raise ServiceError(404, 'Bookmark not found or not authorized')
+    versions.bump(db, username)
+    content_store.release_content(db, deleted.get('content_hash'))
+    return {'success': True}
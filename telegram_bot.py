@@ -1,18 +1,24 @@
+import asyncio
 import os
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler, ConversationHandler
-import requests
-import aiofiles
-import aiohttp
+import io
+import re
 import uuid
 import html
 from bs4 import BeautifulSoup
+from bot_client import BackendClient
 
 load_dotenv()
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 WEBSITE_URL = os.getenv("WEBSITE_URL")
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", 32))
+BOOKMARKS_PAGE_SIZE = 10
+
+# Talks to the web app over HTTP unless main() is handed a LocalClient
+backend = BackendClient(WEBSITE_URL)
 
 # Define states
 USERNAME, PASSWORD, SIGNUP_USERNAME, SIGNUP_PASSWORD = range(4)
@@ -33,11 +39,11 @@ async def get_password(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     username = context.user_data['username']
     password = update.message.text
     
-    response = requests.post(f"{WEBSITE_URL}/login", json={"username": username, "password": password})
+    response = await backend.login(username, password)
     
-    if response.status_code == 200:
+    if response.status == 200:
         context.user_data['logged_in'] = True
-        context.user_data['session_id'] = response.cookies.get('session')
+        context.user_data['session_id'] = response.session_id
         await update.message.reply_text(f"Welcome, {username}! You are now logged in.")
         return ConversationHandler.END
     else:
@@ -57,12 +63,12 @@ async def get_signup_password(update: Update, context: ContextTypes.DEFAULT_TYPE
     username = context.user_data['signup_username']
     password = update.message.text
     
-    response = requests.post(f"{WEBSITE_URL}/signup", json={"username": username, "password": password})
+    response = await backend.signup(username, password)
     
-    if response.status_code == 200:
+    if response.status == 200:
         context.user_data['logged_in'] = True
         context.user_data['username'] = username
-        context.user_data['session_id'] = response.cookies.get('session')
+        context.user_data['session_id'] = response.session_id
         await update.message.reply_text(f"Welcome, {username}! Your account has been created and you are now logged in.")
         return ConversationHandler.END
     else:
@@ -72,8 +78,7 @@ async def get_signup_password(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def logout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if context.user_data.get('logged_in'):
         try:
-            response = requests.post(f"{WEBSITE_URL}/logout",
-                                     cookies={"session": context.user_data.get('session_id', '')})
+            response = await backend.logout(session_id=context.user_data.get('session_id'))
             response.raise_for_status()
             context.user_data.clear()
             await update.message.reply_text("You have been logged out.")
@@ -93,73 +98,157 @@ async def add_bookmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     url = context.args[0]
     try:
         # First, fetch the content
-        fetch_response = requests.post(f"{WEBSITE_URL}/fetch", 
-                                       json={"url": url},
-                                       cookies={"session": context.user_data.get('session_id', '')})
+        fetch_response = await backend.fetch(url, session_id=context.user_data.get('session_id'))
         fetch_response.raise_for_status()
-        content = fetch_response.json()
+        content = fetch_response.data
         
         # Then, save the bookmark
-        save_response = requests.post(f"{WEBSITE_URL}/save_bookmark", 
-                                      json={"url": url, "title": content['title'], "summary": content['summary']},
-                                      cookies={"session": context.user_data.get('session_id', '')})
+        save_response = await backend.save_bookmark({"url": url, "title": content['title'], "type": content['type'],
+                                                     "summary": content.get('summary', ''),
+                                                     "links": content.get('links', [])},
+                                                    session_id=context.user_data.get('session_id'))
         save_response.raise_for_status()
-        await update.message.reply_text(f"Bookmark added successfully: {content['title']}")
+        message = f"Bookmark added successfully: {content['title']}"
+        duplicates = save_response.data.get('duplicates') or []
+        if duplicates:
+            message += f"\nLooks like a copy of a bookmark you already have: {duplicates[0]['title'] or duplicates[0]['url']}"
+        await update.message.reply_text(message)
     except Exception as e:
         await update.message.reply_text(f"Error adding bookmark: {str(e)}")
 
+async def get_bookmark_page(context: ContextTypes.DEFAULT_TYPE, cursor: dict):
+    params = {"limit": BOOKMARKS_PAGE_SIZE, "fields": "title,url", **cursor}
+    response = await backend.list_bookmarks(session_id=context.user_data.get('session_id'), **params)
+    response.raise_for_status()
+    page = response.data
+
+    keyboard = []
+    for bookmark in page['bookmarks']:
+        callback_data = f"read_bookmark_{bookmark['_id']}"
+        keyboard.append([InlineKeyboardButton(bookmark.get('title') or bookmark.get('url') or 'Untitled',
+                                              callback_data=callback_data)])
+
+    navigation = []
+    if page.get('prev_cursor'):
+        navigation.append(InlineKeyboardButton("« Newer", callback_data=f"list_before_{page['prev_cursor']}"))
+    if page.get('next_cursor'):
+        navigation.append(InlineKeyboardButton("Older »", callback_data=f"list_after_{page['next_cursor']}"))
+    if navigation:
+        keyboard.append(navigation)
+    return page['bookmarks'], InlineKeyboardMarkup(keyboard)
+
 async def list_bookmarks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not context.user_data.get('logged_in'):
         await update.message.reply_text("Please login first using /login command.")
         return
     
     try:
-        response = requests.get(f"{WEBSITE_URL}/bookmarks",
-                                cookies={"session": context.user_data.get('session_id', '')})
-        response.raise_for_status()
-        bookmarks = response.json()
+        bookmarks, reply_markup = await get_bookmark_page(context, {})
         if not bookmarks:
             await update.message.reply_text("You have no saved bookmarks.")
             return
         
-        keyboard = []
-        for bookmark in bookmarks:
-            callback_data = f"read_bookmark_{bookmark['_id']}"
-            keyboard.append([InlineKeyboardButton(bookmark['title'], callback_data=callback_data)])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text("Your bookmarks:", reply_markup=reply_markup)
     except Exception as e:
         await update.message.reply_text(f"Error listing bookmarks: {str(e)}")
 
+async def list_bookmarks_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    _, direction, cursor = query.data.split('_', 2)
+    try:
+        bookmarks, reply_markup = await get_bookmark_page(context, {direction: cursor})
+        if not bookmarks:
+            await query.edit_message_text("No more bookmarks.")
+            return
+
+        await query.edit_message_text("Your bookmarks:", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"Error listing bookmarks: {str(e)}")
+
+async def get_search_page(context: ContextTypes.DEFAULT_TYPE, terms: str, page: int):
+    response = await backend.search(terms, session_id=context.user_data.get('session_id'),
+                                    limit=BOOKMARKS_PAGE_SIZE, page=page)
+    response.raise_for_status()
+    data = response.data
+
+    keyboard = []
+    for bookmark in data['results']:
+        callback_data = f"read_bookmark_{bookmark['_id']}"
+        keyboard.append([InlineKeyboardButton(bookmark.get('title') or bookmark.get('url') or 'Untitled',
+                                              callback_data=callback_data)])
+
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton("« Previous", callback_data=f"search_page_{page - 1}"))
+    if data.get('has_more'):
+        navigation.append(InlineKeyboardButton("More »", callback_data=f"search_page_{page + 1}"))
+    if navigation:
+        keyboard.append(navigation)
+    return data['results'], InlineKeyboardMarkup(keyboard)
+
+async def search_bookmarks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not context.user_data.get('logged_in'):
+        await update.message.reply_text("Please login first using /login command.")
+        return
+
+    if not context.args:
+        await update.message.reply_text("Please provide search terms. Usage: /search <terms>")
+        return
+    terms = ' '.join(context.args)
+    try:
+        results, reply_markup = await get_search_page(context, terms, 1)
+        if not results:
+            await update.message.reply_text(f"No bookmarks match \"{terms}\".")
+            return
+
+        # Remember the terms so the paging buttons can repeat the search
+        context.user_data['search_terms'] = terms
+        await update.message.reply_text(f"Bookmarks matching \"{terms}\":", reply_markup=reply_markup)
+    except Exception as e:
+        await update.message.reply_text(f"Error searching bookmarks: {str(e)}")
+
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    terms = context.user_data.get('search_terms')
+    if not terms:
+        await query.edit_message_text("This search has expired. Please run /search again.")
+        return
+    page = int(query.data.split('_')[2])
+    try:
+        results, reply_markup = await get_search_page(context, terms, page)
+        if not results:
+            await query.edit_message_text("No more results.")
+            return
+
+        await query.edit_message_text(f"Bookmarks matching \"{terms}\":", reply_markup=reply_markup)
+    except Exception as e:
+        await query.edit_message_text(f"Error searching bookmarks: {str(e)}")
+
 async def read_bookmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     
     bookmark_id = query.data.split('_')[2]
     try:
-        response = requests.get(f"{WEBSITE_URL}/bookmark/{bookmark_id}",
-                                cookies={"session": context.user_data.get('session_id', '')})
+        # The server keeps the content extracted when the bookmark was saved
+        response = await backend.bookmark_content(bookmark_id, session_id=context.user_data.get('session_id'))
         response.raise_for_status()
-        bookmark = response.json()
+        content = response.data
         
-        if 'url' not in bookmark or not bookmark['url']:
+        if not content.get('url'):
             await query.edit_message_text("Error: Bookmark URL is missing or invalid.")
             return
 
-        # Fetch the content of the bookmark
-        fetch_response = requests.post(f"{WEBSITE_URL}/fetch",
-                                       json={"url": bookmark['url']},
-                                       cookies={"session": context.user_data.get('session_id', '')})
-        fetch_response.raise_for_status()
-        content = fetch_response.json()
-        
         if 'type' not in content:
             await query.edit_message_text("Error: Unable to determine content type.")
             return
 
-        message = f"<b>{html.escape(bookmark['title'])}</b>\n\n"
-        message += f"URL: {html.escape(bookmark['url'])}\n\n"
+        message = f"<b>{html.escape(content.get('title') or '')}</b>\n\n"
+        message += f"URL: {html.escape(content['url'])}\n\n"
 
         if content['type'] == 'article':
             soup = BeautifulSoup(content.get('full_text', ''), 'html.parser')
@@ -177,7 +266,7 @@ async def read_bookmark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
         # Generate a unique ID for this bookmark read operation
         read_id = str(uuid.uuid4())
-        context.user_data[f'read_{read_id}'] = bookmark['url']
+        context.user_data[f'read_{read_id}'] = bookmark_id
 
         # Add a download button
         keyboard = [
@@ -208,11 +297,9 @@ async def fetch_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     url = context.args[0]
     try:
-        response = requests.post(f"{WEBSITE_URL}/fetch", 
-                                 json={"url": url},
-                                 cookies={"session": context.user_data.get('session_id', '')})
+        response = await backend.fetch(url, session_id=context.user_data.get('session_id'))
         response.raise_for_status()
-        content = response.json()
+        content = response.data
         
         if content['type'] == 'article':
             # Strip HTML tags from the summary
@@ -244,43 +331,44 @@ async def fetch_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     except Exception as e:
         await update.message.reply_text(f"Error fetching content: {str(e)}")
 
+def download_filename(title):
+    name = re.sub(r'[^\w\- .]+', '', title or '').strip()[:50]  # Limit filename length
+    return f"{name or 'content'}.txt"
+
 async def download_content(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
     await query.answer()
     
     operation_id = query.data.split('_')[1]
-    url = context.user_data.get(f'fetch_{operation_id}') or context.user_data.get(f'read_{operation_id}')
+    url = context.user_data.get(f'fetch_{operation_id}')
+    bookmark_id = context.user_data.get(f'read_{operation_id}')
     
-    if not url:
+    if not url and not bookmark_id:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, the download link has expired. Please fetch the URL or read the bookmark again.")
         return
     
     try:
-        response = requests.post(f"{WEBSITE_URL}/fetch", 
-                                 json={"url": url},
-                                 cookies={"session": context.user_data.get('session_id', '')})
+        if bookmark_id:
+            response = await backend.bookmark_content(bookmark_id, session_id=context.user_data.get('session_id'))
+        else:
+            response = await backend.fetch(url, session_id=context.user_data.get('session_id'))
         response.raise_for_status()
-        content = response.json()
-        
-        # Save content to a file
-        filename = f"{content['title'][:50]}.txt"  # Limit filename length
-        async with aiofiles.open(filename, mode='w', encoding='utf-8') as file:
-            await file.write(f"Title: {content['title']}\n\n")
-            await file.write(f"URL: {url}\n\n")
-            if content['type'] == 'article':
-                soup = BeautifulSoup(content['full_text'], 'html.parser')
-                clean_content = soup.get_text()
-                await file.write(f"Content:\n{clean_content}")
-            elif content['type'] == 'list':
-                await file.write("Links:\n")
-                for link in content['links']:
-                    await file.write(f"- {link['title']}: {link['url']}\n")
+        content = response.data
+        url = content.get('url') or url
         
+        # Build the file in memory: nothing touches the disk and concurrent downloads can't collide
+        lines = [f"Title: {content['title']}\n\n", f"URL: {url}\n\n"]
+        if content['type'] == 'article':
+            soup = BeautifulSoup(content['full_text'], 'html.parser')
+            lines.append(f"Content:\n{soup.get_text()}")
+        elif content['type'] == 'list':
+            lines.append("Links:\n")
+            lines.extend(f"- {link['title']}: {link['url']}\n" for link in content['links'])
+        document = io.BytesIO(''.join(lines).encode('utf-8'))
+
         # Send the file to the user
-        await context.bot.send_document(chat_id=update.effective_chat.id, document=open(filename, 'rb'))
-        
-        # Delete the file after sending
-        os.remove(filename)
+        await context.bot.send_document(chat_id=update.effective_chat.id, document=document,
+                                        filename=download_filename(content['title']))
         
         # Clean up the stored URL
         if f'fetch_{operation_id}' in context.user_data:
@@ -307,7 +395,8 @@ Available commands:
 /signup - Create a new account
 /logout - Log out of your account
 /add <url> - Add a new bookmark
-/list - List all your saved bookmarks
+/list - List your saved bookmarks, one page at a time
+/search <terms> - Search your saved bookmarks
 /fetch <url> - Fetch content from a URL and offer to download
 /website - Get a link to the web application
 
@@ -315,7 +404,7 @@ How to use:
 1. Start by logging in with /login or signing up with /signup
 2. Use /add to save new bookmarks
 3. Use /list to see all your saved bookmarks
-4. Use /fetch to get content from any URL
+4. Use /search to find a saved bookmark, or /fetch to get content from any URL
 5. After fetching, you can choose to download the full content
 6. Use /logout when you're done
 
@@ -323,8 +412,26 @@ For any issues or questions, please contact the bot administrator.
     """
     await update.message.reply_text(help_text)
 
-def main() -> None:
-    application = Application.builder().token(TOKEN).build()
+async def post_init(application: Application) -> None:
+    await backend.start()
+
+async def post_shutdown(application: Application) -> None:
+    await backend.close()
+
+def build_application(client=None) -> Application:
+    global backend
+    if client is not None:
+        backend = client
+
+    # Updates are handled concurrently so one slow /fetch doesn't hold up other users
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     login_handler = ConversationHandler(
         entry_points=[CommandHandler("login", login)],
@@ -351,12 +458,34 @@ def main() -> None:
     application.add_handler(CommandHandler("logout", logout))
     application.add_handler(CommandHandler("add", add_bookmark))
     application.add_handler(CommandHandler("list", list_bookmarks))
+    application.add_handler(CommandHandler("search", search_bookmarks))
     application.add_handler(CommandHandler("fetch", fetch_url))
     application.add_handler(CommandHandler("website", website))
     application.add_handler(CallbackQueryHandler(download_content, pattern="^download_"))
     application.add_handler(CallbackQueryHandler(read_bookmark, pattern="^read_bookmark_"))
-
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    application.add_handler(CallbackQueryHandler(list_bookmarks_page, pattern="^list_(after|before)_"))
+    application.add_handler(CallbackQueryHandler(search_page, pattern="^search_page_"))
+    return application
+
+async def run(client=None) -> None:
+    # Runs the bot inside an already running event loop until cancelled, then shuts down cleanly
+    application = build_application(client)
+    await application.initialize()
+    await post_init(application)
+    try:
+        await application.start()
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        await asyncio.Event().wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+def main(client=None) -> None:
+    build_application(client).run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
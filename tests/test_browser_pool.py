@@ -0,0 +1,88 @@
+import asyncio
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import browser_pool
+
+
+class FakeResponse:
+    headers = {}
+
+
+class FakePage:
+    def on(self, event, handler):
+        pass
+
+    def is_closed(self):
+        return False
+
+    async def goto(self, url, wait_until, timeout):
+        return FakeResponse()
+
+    async def evaluate(self, script, arg):
+        return 'stable'
+
+    async def content(self):
+        return '<html></html>'
+
+
+class FakeContext:
+    async def route(self, pattern, handler):
+        pass
+
+    async def new_page(self):
+        return FakePage()
+
+    async def close(self):
+        pass
+
+
+class FakeBrowser:
+    def is_connected(self):
+        return True
+
+    async def new_context(self):
+        return FakeContext()
+
+    async def close(self):
+        pass
+
+
+class FakePlaywright:
+    def __init__(self):
+        self.launches = 0
+        self.chromium = self
+
+    async def start(self):
+        await asyncio.sleep(0.01)
+        return self
+
+    async def launch(self):
+        self.launches += 1
+        await asyncio.sleep(0.01)
+        return FakeBrowser()
+
+    async def stop(self):
+        pass
+
+
+def test_concurrent_first_renders_launch_one_browser(monkeypatch):
+    playwright = FakePlaywright()
+    module = types.ModuleType('playwright.async_api')
+    module.async_playwright = lambda: playwright
+    monkeypatch.setitem(sys.modules, 'playwright', types.ModuleType('playwright'))
+    monkeypatch.setitem(sys.modules, 'playwright.async_api', module)
+
+    pool = browser_pool.BrowserPool(browsers=1, max_pages=4)
+
+    async def run():
+        await asyncio.gather(*(pool.render(f"http://example.com/{i}") for i in range(4)))
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
+    assert playwright.launches == 1
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from content_cache import ContentCache
+
+
+def flush(cache):
+    cache._disk_writer.submit(lambda: None).result()
+
+
+def disk_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith('.json'))
+
+
+def test_disk_budget_removes_oldest_files(tmp_path):
+    cache = ContentCache(disk_dir=str(tmp_path), disk_max_bytes=2500)
+    for i in range(5):
+        cache.put(f"http://example.com/{i}", {'text': 'x' * 1000}, {})
+    flush(cache)
+    assert len(disk_files(tmp_path)) == 2
+    assert os.path.exists(cache._disk_path('http://example.com/4'))
+    assert not os.path.exists(cache._disk_path('http://example.com/0'))
+    assert cache.stats()['disk_evictions'] == 3
+    assert cache.stats()['disk_bytes'] <= 2500
+
+
+def test_budget_covers_files_from_earlier_runs(tmp_path):
+    first = ContentCache(disk_dir=str(tmp_path))
+    for i in range(3):
+        first.put(f"http://example.com/{i}", {'text': 'x' * 1000}, {})
+        flush(first)
+        old = time.time() - 100 + i
+        os.utime(first._disk_path(f"http://example.com/{i}"), (old, old))
+    second = ContentCache(disk_dir=str(tmp_path), disk_max_bytes=2500)
+    flush(second)
+    assert not os.path.exists(second._disk_path('http://example.com/0'))
+    assert second.get('http://example.com/2').result == {'text': 'x' * 1000}
+
+
+def test_get_async_reads_disk_and_invalidate_removes_file(tmp_path):
+    first = ContentCache(disk_dir=str(tmp_path))
+    first.put('http://example.com/', {'title': 'T'}, {})
+    flush(first)
+    cache = ContentCache(disk_dir=str(tmp_path))
+    entry = asyncio.run(cache.get_async('http://example.com/'))
+    assert entry.result == {'title': 'T'}
+    assert cache.stats()['disk_hits'] == 1
+    cache.invalidate('http://example.com/')
+    flush(cache)
+    assert disk_files(tmp_path) == []
+    assert cache.stats()['disk_bytes'] == 0
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler as scheduler_module
+from scheduler import FetchScheduler
+
+
+class CancelOnGrant(FetchScheduler):
+    # Grants the slot and cancels the waiting task in the same callback, so the
+    # task is cancelled after the grant but before it resumes
+    task = None
+
+    def _grant(self, host, loop, future):
+        def resolve():
+            future.set_result(None)
+            self.task.cancel()
+        loop.call_soon_threadsafe(resolve)
+
+
+def test_cancel_after_grant_releases_slot(monkeypatch):
+    # No spacing between grants, so the second acquire waits only on the released slot
+    monkeypatch.setattr(scheduler_module, 'FETCH_HOST_INTERVAL', 0)
+    scheduler = CancelOnGrant(max_concurrency=4, host_concurrency=1)
+
+    async def run():
+        scheduler.task = asyncio.get_running_loop().create_task(scheduler.acquire('h'))
+        try:
+            await scheduler.task
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.stats()['active'] == 0
+
+        # The task that was cancelled is done, so this grant goes through
+        await asyncio.wait_for(scheduler.acquire('h'), 1)
+        scheduler.release('h')
+
+    asyncio.run(run())
+
+
+def test_cancel_while_waiting_removes_waiter():
+    scheduler = FetchScheduler(max_concurrency=4, host_concurrency=1)
+
+    async def run():
+        await scheduler.acquire('h')
+        waiting = asyncio.get_running_loop().create_task(scheduler.acquire('h'))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        assert scheduler.stats() == {'active': 1, 'waiting': 0, 'hosts': 1}
+        scheduler.release('h')
+        assert scheduler.stats()['active'] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,24 @@
+import hashlib
+
+# A per-user counter, kept on the users document, that every write to the
+# user's bookmarks bumps. Responses built from the bookmarks derive their ETag
+# from it, so a conditional request is answered with one lookup by username.
+
+
+def bump(db, *usernames):
+    usernames = list({username for username in usernames if username})
+    if len(usernames) == 1:
+        db.users.update_one({'username': usernames[0]}, {'$inc': {'bookmarks_version': 1}})
+    elif usernames:
+        db.users.update_many({'username': {'$in': usernames}}, {'$inc': {'bookmarks_version': 1}})
+
+
+def current(db, username):
+    user = db.users.find_one({'username': username}, {'bookmarks_version': 1})
+    return (user or {}).get('bookmarks_version', 0)
+
+
+def etag(db, username, *parts):
+    # Strong ETag for one view of the user's bookmarks at their current version
+    key = '\0'.join([username, str(current(db, username))] + [str(part) for part in parts])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]